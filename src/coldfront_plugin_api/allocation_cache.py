@@ -0,0 +1,118 @@
+"""
+Cache of serialized allocations, stored in the Django cache backend.
+
+Each allocation is cached under its id and a version. Invalidating an
+allocation drops its version, so the next read picks a new version and any
+payload serialized from older data is never read again, even if it is
+written after the invalidation. The receivers in `receivers.py` invalidate
+allocations when they, their attributes, users, resources or project change.
+Changes to the objects shared by many allocations, such as resource types or
+status choices, bump the ALLOCATION_RELATIONS generation instead, which is
+part of the key of every payload.
+
+The cache is enabled with PLUGIN_API_ALLOCATION_CACHE, and requires a cache
+backend shared by every process (i.e. Redis or Memcached). Invalidations only
+reach the cache backend of the process making the change, so with a per
+process backend such as Django's default LocMemCache, changes made by other
+web workers or management commands would be served stale until the timeout.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from coldfront_plugin_api import generations, metrics
+
+KEY_PREFIX = "coldfront_plugin_api:allocation"
+
+# Bump whenever the serialized representation of an allocation changes
+SERIALIZER_VERSION = 1
+
+
+def _version_key(allocation_id):
+    return f"{KEY_PREFIX}:{allocation_id}:version"
+
+
+def _payload_key(allocation_id, version, generation):
+    return f"{KEY_PREFIX}:{allocation_id}:{version}:{generation}"
+
+
+def is_enabled() -> bool:
+    return settings.PLUGIN_API_ALLOCATION_CACHE
+
+
+def _get_versions(allocation_ids) -> dict:
+    keys = {_version_key(pk): pk for pk in allocation_ids}
+    found = cache.get_many(keys, version=SERIALIZER_VERSION)
+    versions = {keys[key]: version for key, version in found.items()}
+
+    new_versions = {
+        key: uuid.uuid4().hex for key, pk in keys.items() if pk not in versions
+    }
+    if new_versions:
+        cache.set_many(new_versions, timeout=None, version=SERIALIZER_VERSION)
+        # Concurrent requests may have set other versions for the same
+        # allocations, read back the versions that were kept.
+        found = cache.get_many(new_versions, version=SERIALIZER_VERSION)
+        for key, version in new_versions.items():
+            versions[keys[key]] = found.get(key, version)
+    return versions
+
+
+def get_or_serialize(allocation_ids, serialize) -> list:
+    """
+    Returns the serialized allocations in the order of `allocation_ids`.
+
+    Cached payloads are fetched with a single `get_many`. The remaining
+    allocations are serialized in one batch by calling `serialize` with their
+    ids, which must return a dict of id to serialized allocation, and are then
+    cached. Allocations that no longer exist are left out.
+
+    When the cache isn't enabled, every allocation is serialized.
+    """
+    unique_ids = list(dict.fromkeys(allocation_ids))
+    if not is_enabled():
+        serialized = serialize(unique_ids)
+        return [serialized[pk] for pk in allocation_ids if pk in serialized]
+
+    versions = _get_versions(unique_ids)
+    generation = generations.aggregate(generations.ALLOCATION_RELATIONS)[
+        generations.ALLOCATION_RELATIONS
+    ]
+    keys = {_payload_key(pk, versions[pk], generation): pk for pk in unique_ids}
+    found = cache.get_many(keys, version=SERIALIZER_VERSION)
+    payloads = {keys[key]: payload for key, payload in found.items()}
+
+    missing_ids = [pk for pk in unique_ids if pk not in payloads]
+    metrics.incr("allocation_cache.hits", len(payloads))
+    metrics.incr("allocation_cache.misses", len(missing_ids))
+
+    if missing_ids:
+        serialized = serialize(missing_ids)
+        cache.set_many(
+            {
+                _payload_key(pk, versions[pk], generation): data
+                for pk, data in serialized.items()
+            },
+            timeout=settings.PLUGIN_API_ALLOCATION_CACHE_TIMEOUT,
+            version=SERIALIZER_VERSION,
+        )
+        payloads.update(serialized)
+
+    return [payloads[pk] for pk in allocation_ids if pk in payloads]
+
+
+def invalidate(allocation_ids):
+    keys = [_version_key(pk) for pk in allocation_ids]
+    if not keys:
+        return
+
+    cache.delete_many(keys, version=SERIALIZER_VERSION)
+    if transaction.get_connection().in_atomic_block:
+        # Concurrent requests may cache payloads serialized from the data as it
+        # was before this transaction, so invalidate again once it commits.
+        transaction.on_commit(
+            lambda: cache.delete_many(keys, version=SERIALIZER_VERSION)
+        )
@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class ColdfrontPluginApiConfig(AppConfig):
+    name = "coldfront_plugin_api"
+
+    def ready(self):
+        # Connects the signal receivers and registers the system checks
+        from coldfront_plugin_api import checks, receivers  # noqa: F401
@@ -1,9 +1,75 @@
+import base64
+import binascii
+import hashlib
+import json
 import os
+import time
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework.authentication import SessionAuthentication, BasicAuthentication
 from mozilla_django_oidc.contrib.drf import OIDCAuthentication
 
-if os.getenv("PLUGIN_AUTH_OIDC") == "True":
-    AUTHENTICATION_CLASSES = [OIDCAuthentication, SessionAuthentication]
+from coldfront_plugin_api import metrics
+
+PLUGIN_AUTH_OIDC = os.getenv("PLUGIN_AUTH_OIDC") == "True"
+
+TOKEN_KEY_PREFIX = "coldfront_plugin_api:oidc_token"
+
+
+def _token_key(access_token):
+    return f"{TOKEN_KEY_PREFIX}:{hashlib.sha256(access_token.encode()).hexdigest()}"
+
+
+def _get_token_timeout(access_token):
+    """
+    Returns for how long a validated token can be cached, which is never
+    past the expiration time of the token, if it is a JWT.
+    """
+    timeout = settings.PLUGIN_API_OIDC_TOKEN_CACHE_TIMEOUT
+    try:
+        payload = access_token.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        expires = int(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError, binascii.Error):
+        # Not a JWT, or one without an expiration time
+        return timeout
+    return min(timeout, int(expires - time.time()))
+
+
+class CachedOIDCAuthentication(OIDCAuthentication):
+    """
+    OIDC bearer token authentication that caches the user of every validated
+    token, so that requests reusing a token don't each make a round trip to
+    the identity provider.
+
+    Tokens are cached under their hash for PLUGIN_API_OIDC_TOKEN_CACHE_TIMEOUT
+    seconds, and never past their expiration time.
+    """
+
+    def authenticate(self, request):
+        access_token = self.get_access_token(request)
+        if not access_token:
+            return None
+
+        key = _token_key(access_token)
+        if user_id := cache.get(key):
+            if user := User.objects.filter(pk=user_id, is_active=True).first():
+                metrics.incr("oidc_token_cache.hits")
+                return user, access_token
+
+        metrics.incr("oidc_token_cache.misses")
+        user, access_token = super().authenticate(request)
+
+        if (timeout := _get_token_timeout(access_token)) > 0:
+            cache.set(key, user.pk, timeout=timeout)
+        return user, access_token
+
+
+if PLUGIN_AUTH_OIDC:
+    AUTHENTICATION_CLASSES = [CachedOIDCAuthentication, SessionAuthentication]
 else:
     AUTHENTICATION_CLASSES = [SessionAuthentication, BasicAuthentication]
@@ -0,0 +1,32 @@
+"""
+System checks of the plugin's settings.
+"""
+
+from django.conf import settings
+from django.core import checks
+
+# Cache backends that aren't shared between processes
+LOCAL_CACHE_BACKENDS = (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+
+@checks.register(checks.Tags.caches)
+def check_allocation_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get("default", {}).get("BACKEND")
+    if settings.PLUGIN_API_ALLOCATION_CACHE and backend in LOCAL_CACHE_BACKENDS:
+        return [
+            checks.Warning(
+                "PLUGIN_API_ALLOCATION_CACHE is enabled with a cache backend that "
+                "isn't shared between processes.",
+                hint=(
+                    "Changes made by other processes won't invalidate the cached "
+                    "allocations of this one. Configure a shared cache backend, "
+                    "such as Redis or Memcached, or disable the cache."
+                ),
+                obj=backend,
+                id="coldfront_plugin_api.W001",
+            )
+        ]
+    return []
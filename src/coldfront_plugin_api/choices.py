@@ -0,0 +1,54 @@
+"""
+Registry of the choice objects of ColdFront (i.e. AllocationUserStatusChoice),
+shared by the write paths of the plugin.
+
+The choices of a model are loaded together on first use and kept in process
+memory, as they essentially never change. The receivers in `receivers.py`
+clear the choices of a model when any of them is saved or deleted.
+"""
+
+import threading
+
+from coldfront.core.allocation.models import AllocationUserStatusChoice
+from coldfront.core.project.models import ProjectUserRoleChoice, ProjectUserStatusChoice
+
+# Models whose choices are kept in the registry
+MODELS = (AllocationUserStatusChoice, ProjectUserStatusChoice, ProjectUserRoleChoice)
+
+_choices = {}
+_lock = threading.Lock()
+
+
+def _load(model) -> dict:
+    choices = {choice.name: choice for choice in model.objects.all()}
+    with _lock:
+        _choices[model] = choices
+    return choices
+
+
+def get(model, name):
+    """
+    Returns the choice of the model with the name, like
+    `model.objects.get(name=name)`, without a query once the choices of the
+    model are loaded.
+    """
+    with _lock:
+        choices = _choices.get(model)
+    if choices is None or name not in choices:
+        # The choice may have been created since the choices were loaded
+        choices = _load(model)
+    if name not in choices:
+        raise model.DoesNotExist(
+            f"{model.__name__} matching name {name!r} does not exist."
+        )
+    return choices[name]
+
+
+def invalidate(model):
+    with _lock:
+        _choices.pop(model, None)
+
+
+def clear():
+    with _lock:
+        _choices.clear()
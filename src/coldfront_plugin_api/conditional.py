@@ -0,0 +1,163 @@
+"""
+Support for HTTP conditional requests (ETag / 304 Not Modified).
+
+Validators are computed with aggregate queries over the `modified` timestamps
+and row counts of the rows a response is built from, and with the generations
+of the data that has no timestamps, so that unchanged responses can be
+answered without serializing anything.
+
+No Last-Modified validator is sent: rows removed from a response (i.e.
+deleted, or no longer matching its filters) don't advance the latest timestamp
+of the rows left in it, and HTTP dates are truncated to whole seconds, so
+changes made in the same second as a request would be missed.
+"""
+
+import hashlib
+from typing import NamedTuple
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import quote_etag
+from coldfront.core.allocation.models import AllocationAttribute, AllocationUser
+
+from coldfront_plugin_api import generations
+from coldfront_plugin_api.serializers import AllocationSerializer
+
+
+class Validators(NamedTuple):
+    etag: str
+    # Digest of the aggregates alone, which is the same for every page and
+    # filter of a collection until one of its rows changes.
+    version: str
+    # Request headers the response varies on
+    vary: tuple = ()
+
+
+def make_validators(request, *aggregates) -> Validators:
+    """
+    Builds the validators from the results of aggregate queries. The ETag also
+    covers the request's path and query string, and the format negotiated from
+    the Accept header by DRF views, as they change the response.
+    """
+    digest = hashlib.sha256()
+    for aggregate in aggregates:
+        for key, value in sorted(aggregate.items()):
+            digest.update(f"\n{key}={value}".encode("utf-8"))
+
+    version = digest.hexdigest()
+    renderer = getattr(request, "accepted_renderer", None)
+    variant = renderer.format if renderer else ""
+    etag = hashlib.sha256(
+        f"{request.get_full_path()}\n{variant}\n{version}".encode("utf-8")
+    )
+    return Validators(
+        etag=quote_etag(etag.hexdigest()),
+        version=version,
+        vary=("Accept",) if renderer else (),
+    )
+
+
+def allocation_validators(request, queryset, fieldset=(None, None)) -> Validators:
+    """
+    Validators for the serialized allocations in the queryset.
+
+    Only the relations of the fields returned, as given by the fieldset of
+    `AllocationViewSet.get_fieldset`, are queried.
+    """
+    fields, attribute_type_ids = fieldset
+    if fields is None:
+        fields = AllocationSerializer.Meta.fields
+
+    queryset = queryset.order_by()
+    aggregates = {
+        "allocation_count": Count("pk"),
+        "allocation_modified": Max("modified"),
+    }
+    if "project" in fields:
+        aggregates["project_modified"] = Max("project__modified")
+    results = [queryset.aggregate(**aggregates)]
+
+    if "attributes" in fields:
+        attributes = AllocationAttribute.objects.filter(
+            allocation__in=queryset.values("pk")
+        )
+        if attribute_type_ids is not None:
+            attributes = attributes.filter(
+                allocation_attribute_type_id__in=attribute_type_ids
+            )
+        results.append(
+            attributes.aggregate(
+                attribute_count=Count("pk"),
+                attribute_modified=Max("modified"),
+            )
+        )
+
+    names = []
+    if "project" in fields or "resource" in fields:
+        names.append(generations.ALLOCATIONS)
+    if {"project", "resource", "status", "attributes"} & set(fields):
+        names.append(generations.ALLOCATION_RELATIONS)
+    if names:
+        results.append(generations.aggregate(*names))
+
+    return make_validators(request, *results)
+
+
+def group_validators(request, queryset) -> Validators:
+    """Validators for the SCIM groups of the allocations in the queryset."""
+    queryset = queryset.order_by()
+    allocations = queryset.aggregate(
+        allocation_count=Count("pk"),
+        allocation_modified=Max("modified"),
+        project_modified=Max("project__modified"),
+    )
+    users = AllocationUser.objects.filter(
+        allocation__in=queryset.values("pk")
+    ).aggregate(
+        user_count=Count("pk"),
+        user_modified=Max("modified"),
+    )
+    # The members are listed by username
+    return make_validators(
+        request,
+        allocations,
+        users,
+        generations.aggregate(generations.USERS),
+    )
+
+
+def user_validators(request, queryset) -> Validators:
+    """
+    Validators for the SCIM users in the queryset.
+
+    Users have no modified timestamp, so changes to their fields are detected
+    with the USERS generation instead.
+    """
+    users = queryset.order_by().aggregate(
+        user_count=Count("pk"),
+        user_max_pk=Max("pk"),
+        user_joined=Max("date_joined"),
+    )
+    return make_validators(
+        request,
+        users,
+        generations.aggregate(generations.USERS),
+    )
+
+
+def get_not_modified_response(request, validators: Validators):
+    """
+    Returns a 304 (or 412) response if the request's preconditions match the
+    validators, otherwise None.
+    """
+    response = get_conditional_response(request, etag=validators.etag)
+    if response is not None:
+        patch_vary_headers(response, validators.vary)
+    return response
+
+
+def set_validator_headers(response, validators: Validators):
+    if 200 <= response.status_code < 300:
+        response.headers.setdefault("ETag", validators.etag)
+    patch_vary_headers(response, validators.vary)
+    return response
@@ -1,5 +1,5 @@
 from coldfront.config.base import INSTALLED_APPS
-from coldfront.config.env import ENV  # noqa: F401
+from coldfront.config.env import ENV
 
 for app in ["rest_framework", "coldfront_plugin_api", "django_scim"]:
     if app not in INSTALLED_APPS:
@@ -15,4 +15,71 @@ SCIM_SERVICE_PROVIDER = {
     "GROUP_FILTER_PARSER": "coldfront_plugin_api.scim_v2.filters.ColdfrontGroupFilterQuery",
     "GET_IS_AUTHENTICATED_PREDICATE": "coldfront_plugin_api.utils.is_user_superuser",
     "AUTH_CHECK_MIDDLEWARE": "coldfront_plugin_api.scim_v2.auth_middleware.SCIMColdfrontAuthCheckMiddleware",
+    "SERVICE_PROVIDER_CONFIG_MODEL": "coldfront_plugin_api.scim_v2.service_provider.ColdfrontServiceProviderConfig",
+    "AUTHENTICATION_SCHEMES": [
+        {
+            "type": "oauthbearertoken",
+            "name": "OAuth Bearer Token",
+            "description": "Authentication with an OpenID Connect access token",
+            "primary": True,
+        }
+    ],
 }
+
+# Settings for the allocation API
+PLUGIN_API_ALLOCATION_PAGE_SIZE = ENV.int(
+    "PLUGIN_API_ALLOCATION_PAGE_SIZE", default=100
+)
+PLUGIN_API_ALLOCATION_MAX_PAGE_SIZE = ENV.int(
+    "PLUGIN_API_ALLOCATION_MAX_PAGE_SIZE", default=1000
+)
+PLUGIN_API_ALLOCATION_STREAM_CHUNK_SIZE = ENV.int(
+    "PLUGIN_API_ALLOCATION_STREAM_CHUNK_SIZE", default=500
+)
+# Cache serialized allocations. Requires a cache backend shared by every process,
+# see `coldfront_plugin_api.allocation_cache`.
+PLUGIN_API_ALLOCATION_CACHE = ENV.bool("PLUGIN_API_ALLOCATION_CACHE", default=False)
+PLUGIN_API_ALLOCATION_CACHE_TIMEOUT = ENV.int(
+    "PLUGIN_API_ALLOCATION_CACHE_TIMEOUT", default=60 * 60
+)
+# Aggregate the attributes of allocations in the allocation query (PostgreSQL only)
+PLUGIN_API_ALLOCATION_ATTRIBUTES_AGGREGATE = ENV.bool(
+    "PLUGIN_API_ALLOCATION_ATTRIBUTES_AGGREGATE", default=False
+)
+
+# Settings for the SCIM Bulk endpoint
+PLUGIN_API_SCIM_BULK_MAX_OPERATIONS = ENV.int(
+    "PLUGIN_API_SCIM_BULK_MAX_OPERATIONS", default=1000
+)
+PLUGIN_API_SCIM_BULK_MAX_PAYLOAD_SIZE = ENV.int(
+    "PLUGIN_API_SCIM_BULK_MAX_PAYLOAD_SIZE", default=1024 * 1024
+)
+PLUGIN_API_SCIM_BULK_BATCH_SIZE = ENV.int(
+    "PLUGIN_API_SCIM_BULK_BATCH_SIZE", default=100
+)
+
+# Settings for SCIM list responses
+PLUGIN_API_SCIM_MAX_PAGE_SIZE = ENV.int("PLUGIN_API_SCIM_MAX_PAGE_SIZE", default=1000)
+PLUGIN_API_SCIM_PAGINATION_CACHE_TIMEOUT = ENV.int(
+    "PLUGIN_API_SCIM_PAGINATION_CACHE_TIMEOUT", default=10 * 60
+)
+
+# Settings for OIDC bearer token authentication
+PLUGIN_API_OIDC_TOKEN_CACHE_TIMEOUT = ENV.int(
+    "PLUGIN_API_OIDC_TOKEN_CACHE_TIMEOUT", default=5 * 60
+)
+
+# Settings for user lookups in the configured search providers
+PLUGIN_API_USER_SEARCH_WORKERS = ENV.int("PLUGIN_API_USER_SEARCH_WORKERS", default=8)
+PLUGIN_API_USER_SEARCH_CACHE_TIMEOUT = ENV.int(
+    "PLUGIN_API_USER_SEARCH_CACHE_TIMEOUT", default=5 * 60
+)
+PLUGIN_API_USER_SEARCH_NEGATIVE_CACHE_TIMEOUT = ENV.int(
+    "PLUGIN_API_USER_SEARCH_NEGATIVE_CACHE_TIMEOUT", default=60
+)
+PLUGIN_API_USER_SEARCH_CACHE_SIZE = ENV.int(
+    "PLUGIN_API_USER_SEARCH_CACHE_SIZE", default=10000
+)
+PLUGIN_API_USER_SEARCH_SHARED_CACHE = ENV.bool(
+    "PLUGIN_API_USER_SEARCH_SHARED_CACHE", default=False
+)
@@ -0,0 +1,118 @@
+"""
+Translates the query parameters of the allocation API into queryset filters.
+"""
+
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef, Q
+from coldfront.core.allocation.models import (
+    AllocationAttribute,
+    AllocationAttributeType,
+)
+
+
+class FieldFilter(NamedTuple):
+    lookups: tuple
+    index: str
+
+
+RANGE_LOOKUPS = ("exact", "gt", "gte", "lt", "lte")
+
+# Allocation fields that can be filtered on, the lookups allowed on each of them,
+# and the index backing the filter. Indexes prefixed with "cfapi_" are created by
+# this plugin's migrations, the others come with ColdFront and Django.
+FIELD_FILTERS = {
+    "id": FieldFilter(RANGE_LOOKUPS + ("in",), "allocation_allocation primary key"),
+    "project": FieldFilter(("exact", "in"), "allocation_allocation.project_id"),
+    "project__id": FieldFilter(("exact", "in"), "allocation_allocation.project_id"),
+    "project__title": FieldFilter(("exact",), "project_project (title, pi_id) unique"),
+    "project__pi__username": FieldFilter(("exact",), "auth_user.username unique"),
+    "project__pi__email": FieldFilter(("exact",), "cfapi_user_email_idx"),
+    "resources__name": FieldFilter(("exact",), "resource_resource.name unique"),
+    "resources__resource_type__name": FieldFilter(
+        ("exact",), "cfapi_resource_type_name_idx"
+    ),
+    "status__name": FieldFilter(("exact",), "allocation_allocation.status_id"),
+    "start_date": FieldFilter(RANGE_LOOKUPS, "cfapi_alloc_start_date_idx"),
+    "end_date": FieldFilter(RANGE_LOOKUPS, "cfapi_alloc_end_date_idx"),
+    "modified": FieldFilter(RANGE_LOOKUPS, "cfapi_alloc_modified_idx"),
+}
+
+
+def field_filter(query, values):
+    """
+    Returns a filter matching allocations where the field in the query parameter
+    equals any of the values, or None if the field or lookup is not allowed.
+
+    The query parameter is a field from FIELD_FILTERS, optionally followed by
+    one of its lookups, i.e "end_date__lt". The "in" lookup takes a comma
+    separated list of values.
+    """
+    field, _, lookup = query.rpartition("__")
+    if not field or lookup not in RANGE_LOOKUPS + ("in",):
+        field, lookup = query, "exact"
+
+    allowed = FIELD_FILTERS.get(field)
+    if allowed is None or lookup not in allowed.lookups:
+        return None
+
+    q_query = Q()
+    for value in values:
+        if lookup == "in":
+            value = value.split(",")
+        q_query = q_query | Q(**{f"{field}__{lookup}": value})
+    return q_query
+
+
+ATTRIBUTE_TYPE_IDS_CACHE_KEY = "coldfront_plugin_api:attribute_type_ids"
+# Bounds staleness in other processes, as signals only invalidate the local one
+# when the cache backend isn't shared.
+ATTRIBUTE_TYPE_IDS_CACHE_TIMEOUT = 300
+
+
+def _load_attribute_type_ids() -> dict:
+    type_ids = {}
+    for pk, name in AllocationAttributeType.objects.order_by().values_list(
+        "pk", "name"
+    ):
+        type_ids.setdefault(name.lower(), []).append(pk)
+    cache.set(ATTRIBUTE_TYPE_IDS_CACHE_KEY, type_ids, ATTRIBUTE_TYPE_IDS_CACHE_TIMEOUT)
+    return type_ids
+
+
+def get_attribute_type_ids(name) -> list:
+    """
+    Returns the ids of the allocation attribute types matching the name,
+    case insensitive, from a cached map of every attribute type.
+    """
+    type_ids = cache.get(ATTRIBUTE_TYPE_IDS_CACHE_KEY)
+    if type_ids is None or name.lower() not in type_ids:
+        # The attribute type may have been created since the map was cached
+        type_ids = _load_attribute_type_ids()
+    return type_ids.get(name.lower(), [])
+
+
+def invalidate_attribute_type_ids():
+    cache.delete(ATTRIBUTE_TYPE_IDS_CACHE_KEY)
+
+
+def attribute_filter(name, values):
+    """
+    Returns a filter matching allocations with an attribute of the given name
+    equal to any of the values, or None if no attribute type has that name.
+
+    Each attribute is matched with its own EXISTS subquery, so filtering on
+    several attributes neither joins nor duplicates allocation rows.
+    """
+    type_ids = get_attribute_type_ids(name)
+    if not type_ids:
+        return None
+
+    return Exists(
+        AllocationAttribute.objects.filter(
+            allocation=OuterRef("pk"),
+            allocation_attribute_type_id__in=type_ids,
+            value__in=values,
+        )
+    )
@@ -0,0 +1,62 @@
+"""
+Counters of the changes that can't be detected from the data itself, such as
+changes to users, which have no modified timestamp, or to the objects shared
+by every serialized allocation (i.e. resource types or status choices).
+
+The counters are stored in the database, so that changes made by any process
+(other web workers, management commands) are seen by all of them. The
+receivers in `receivers.py` bump them when the data changes. Changes made
+without sending signals, such as `QuerySet.update()`, are not counted.
+"""
+
+import functools
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from coldfront_plugin_api.models import Generation
+
+# Users, as returned by the SCIM Users endpoint or as members of SCIM groups
+USERS = "users"
+# Relations of allocations without a modified timestamp of their own: the PI
+# users of their projects and the resources of allocations.
+ALLOCATIONS = "allocations"
+# Objects serialized into any number of allocations: resources, resource
+# types, fields of science, attribute types and status choices.
+ALLOCATION_RELATIONS = "allocation_relations"
+
+
+def bump(name):
+    """
+    Increments the counter once the current transaction is committed, so that
+    the counter row isn't locked for the rest of the transaction.
+    """
+    transaction.on_commit(functools.partial(_increment, name), robust=True)
+
+
+def _increment(name):
+    now = timezone.now()
+    updated = Generation.objects.filter(name=name).update(
+        value=F("value") + 1, modified=now
+    )
+    if not updated:
+        Generation.objects.get_or_create(
+            name=name, defaults={"value": 1, "modified": now}
+        )
+
+
+def aggregate(*names) -> dict:
+    """
+    Returns the counters, and the time they were last bumped, in a dict like
+    the results of QuerySet.aggregate().
+    """
+    generations = {
+        g.name: g for g in Generation.objects.filter(name__in=names).order_by()
+    }
+    result = {}
+    for name in names:
+        generation = generations.get(name)
+        result[name] = generation.value if generation else 0
+        result[f"{name}_modified"] = generation.modified if generation else None
+    return result
@@ -1,10 +1,12 @@
 from django.core.management.base import BaseCommand
-from coldfront.core.allocation.models import AllocationUser
 from coldfront.core.project.models import (
     ProjectUser,
     ProjectUserStatusChoice,
     ProjectUserRoleChoice,
 )
+from simple_history.utils import bulk_create_with_history
+
+from coldfront_plugin_api import choices, memberships
 
 import logging
 
@@ -22,29 +24,58 @@ class Command(BaseCommand):
             action="store_true",
             help="Applies changes to database by adding allocation users to projects",
         )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of project users to add per query when applying changes",
+        )
 
     def handle(self, *args, **options):
-        # Check all allocation users
-        for a_user in AllocationUser.objects.filter(status__name="Active"):
-            user = a_user.user
-            project = a_user.allocation.project
-            p_user = ProjectUser.objects.filter(
-                user=user, project=project
-            )  # User maybe assigned to more than 1 project
-
-            if not p_user:
-                if options["apply"]:
-                    ProjectUser.objects.create(
-                        project=project,
-                        user=user,
-                        status=ProjectUserStatusChoice.objects.get(name="Active"),
-                        role=ProjectUserRoleChoice.objects.get(name="User"),
+        missing = (
+            memberships.missing_project_users()
+            .order_by("allocation__project_id", "user_id", "allocation_id")
+            .values_list(
+                "allocation_id",
+                "allocation__project_id",
+                "allocation__project__title",
+                "user_id",
+                "user__username",
+            )
+        )
+
+        # A user may be in more than one allocation of the same project
+        pairs = {}
+        for allocation_id, project_id, title, user_id, username in missing:
+            if not options["apply"]:
+                logger.warn(
+                    f"User {username} assgined to allocation pk = {allocation_id}, but not in allocation's project '{title}'"
+                )
+            pairs.setdefault((project_id, user_id), (title, username))
+
+        if options["apply"] and pairs:
+            status = choices.get(ProjectUserStatusChoice, "Active")
+            role = choices.get(ProjectUserRoleChoice, "User")
+            bulk_create_with_history(
+                [
+                    ProjectUser(
+                        project_id=project_id,
+                        user_id=user_id,
+                        status=status,
+                        role=role,
                         enable_notifications=True,
                     )
-                    logger.warn(
-                        f"Added User {user.username} to project '{project.title}'"
-                    )
-                else:
-                    logger.warn(
-                        f"User {user.username} assgined to allocation pk = {a_user.allocation.pk}, but not in allocation's project '{project.title}'"
-                    )
+                    for project_id, user_id in pairs
+                ],
+                ProjectUser,
+                batch_size=options["batch_size"],
+            )
+            for title, username in pairs.values():
+                logger.warn(f"Added User {username} to project '{title}'")
+
+        if options["apply"]:
+            self.stdout.write(f"Added {len(pairs)} users to their allocation's project")
+        else:
+            self.stdout.write(
+                f"Found {len(pairs)} users missing from their allocation's project"
+            )
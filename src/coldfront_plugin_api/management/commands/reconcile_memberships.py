@@ -0,0 +1,194 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import logging
+import multiprocessing
+import os
+
+from django import db
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from coldfront.core.allocation.models import Allocation, AllocationUser
+
+from coldfront_plugin_api import memberships
+
+
+logger = logging.getLogger(__name__)
+
+
+def check_shard(start, end):
+    """Runs every check on the allocations with start <= id < end."""
+    allocation_users = AllocationUser.objects.filter(
+        allocation_id__gte=start, allocation_id__lt=end
+    )
+
+    findings = []
+    for check, query in memberships.CHECKS.items():
+        rows = (
+            query(allocation_users)
+            .order_by("allocation_id", "user__username")
+            .values_list(
+                "allocation_id",
+                "allocation__status__name",
+                "allocation__project_id",
+                "user__username",
+            )
+        )
+        for allocation_id, status, project_id, username in rows:
+            findings.append(
+                {
+                    "check": check,
+                    "allocation": allocation_id,
+                    "allocation_status": status,
+                    "project": project_id,
+                    "user": username,
+                }
+            )
+    return findings
+
+
+class Command(BaseCommand):
+    help = """Checks that the users of allocations are consistent with their projects,
+    and writes a JSON report of the inconsistencies found. Nothing is changed.
+
+    Allocations are checked in shards of consecutive ids, optionally across multiple
+    processes. With --checkpoint, the findings of every shard are appended to the
+    checkpoint file as soon as it is checked, so that an interrupted run resumes from
+    the shards left to check."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shard-size",
+            type=int,
+            default=1000,
+            help="Number of allocation ids checked per shard",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of processes checking shards in parallel",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File to save progress to, and to resume from if it exists",
+        )
+        parser.add_argument(
+            "--output",
+            help="File to write the report to, instead of standard output",
+        )
+
+    def handle(self, *args, **options):
+        shard_size = options["shard_size"]
+        if shard_size < 1:
+            raise CommandError("--shard-size must be a positive integer")
+
+        checkpoint_path = options["checkpoint"]
+        checked = self.load_checkpoint(checkpoint_path, shard_size)
+
+        # Shards are aligned to multiples of the shard size, so that they stay
+        # the same when allocations are created during an interrupted run.
+        bounds = Allocation.objects.aggregate(first=Min("id"), last=Max("id"))
+        shards = []
+        if bounds["first"] is not None:
+            first = bounds["first"] - bounds["first"] % shard_size
+            shards = [
+                start
+                for start in range(first, bounds["last"] + 1, shard_size)
+                if start not in checked
+            ]
+
+        def complete(start, findings):
+            checked[start] = findings
+            self.save_shard(checkpoint_path, start, findings)
+            logger.info(
+                f"Checked allocations {start} to {start + shard_size - 1}, "
+                f"found {len(findings)} inconsistencies"
+            )
+
+        if options["workers"] > 1 and len(shards) > 1:
+            if db.connection.in_atomic_block:
+                raise CommandError(
+                    "--workers can't be used within a transaction, as the "
+                    "workers couldn't see its changes"
+                )
+            # The forked workers must open their own database connections,
+            # rather than share the sockets of the connections of this process.
+            db.connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("fork"),
+            ) as executor:
+                futures = {
+                    executor.submit(check_shard, start, start + shard_size): start
+                    for start in shards
+                }
+                for future in as_completed(futures):
+                    complete(futures[future], future.result())
+        else:
+            for start in shards:
+                complete(start, check_shard(start, start + shard_size))
+
+        findings = sorted(
+            (finding for shard in checked.values() for finding in shard),
+            key=lambda f: (f["allocation"], f["check"], f["user"]),
+        )
+        report = {
+            "summary": {
+                check: sum(1 for f in findings if f["check"] == check)
+                for check in memberships.CHECKS
+            },
+            "findings": findings,
+        }
+
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        # The run is complete, the next one starts over
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    @staticmethod
+    def load_checkpoint(path, shard_size) -> dict:
+        """
+        Returns the findings of the shards saved to the checkpoint, by the start
+        of the shard. The checkpoint is a JSON line with the shard size,
+        followed by a JSON line for every shard checked. A new checkpoint is
+        created if there is none.
+        """
+        if not path:
+            return {}
+        if not os.path.exists(path):
+            with open(path, "w") as f:
+                f.write(json.dumps({"shard_size": shard_size}) + "\n")
+            return {}
+
+        checked = {}
+        with open(path) as f:
+            header = json.loads(f.readline())
+            if header["shard_size"] != shard_size:
+                raise CommandError(
+                    f"Checkpoint {path} was created with --shard-size "
+                    f"{header['shard_size']}"
+                )
+            for line in f:
+                if not line.endswith("\n"):
+                    # The run was interrupted while the shard was being saved
+                    break
+                shard = json.loads(line)
+                checked[shard["start"]] = shard["findings"]
+        return checked
+
+    @staticmethod
+    def save_shard(path, start, findings):
+        """
+        Appends the findings of the shard to the checkpoint, so that saving a
+        shard doesn't depend on the number of shards already checked.
+        """
+        if not path:
+            return
+
+        with open(path, "a") as f:
+            f.write(json.dumps({"start": start, "findings": findings}) + "\n")
@@ -0,0 +1,64 @@
+"""
+Queries for the membership invariants between allocations and projects,
+shared by the fix_allocation_users and reconcile_memberships commands.
+
+Each query takes a queryset of allocation users, which allows checking a
+subset of the allocations, and returns the allocation users that break the
+invariant.
+"""
+
+from django.db.models import Exists, OuterRef
+from coldfront.core.allocation.models import AllocationUser
+from coldfront.core.project.models import ProjectUser
+
+# Allocation statuses that should not have active users
+INACTIVE_ALLOCATION_STATUSES = ("Denied", "Expired", "Revoked")
+
+
+def missing_project_users(allocation_users=None):
+    """Active allocation users who aren't in the allocation's project."""
+    if allocation_users is None:
+        allocation_users = AllocationUser.objects.all()
+
+    return allocation_users.filter(status__name="Active").filter(
+        ~Exists(
+            ProjectUser.objects.filter(
+                user=OuterRef("user"), project=OuterRef("allocation__project")
+            )
+        )
+    )
+
+
+def active_users_of_inactive_allocations(allocation_users=None):
+    """Active allocation users of allocations that are no longer active."""
+    if allocation_users is None:
+        allocation_users = AllocationUser.objects.all()
+
+    return allocation_users.filter(
+        status__name="Active",
+        allocation__status__name__in=INACTIVE_ALLOCATION_STATUSES,
+    )
+
+
+def removed_project_users_in_allocations(allocation_users=None):
+    """Active allocation users who were removed from the allocation's project."""
+    if allocation_users is None:
+        allocation_users = AllocationUser.objects.all()
+
+    return allocation_users.filter(status__name="Active").filter(
+        Exists(
+            ProjectUser.objects.filter(
+                user=OuterRef("user"),
+                project=OuterRef("allocation__project"),
+                status__name="Removed",
+            )
+        )
+    )
+
+
+# Checks run by reconcile_memberships, by the name used in its report
+CHECKS = {
+    "missing_project_user": missing_project_users,
+    "active_user_of_inactive_allocation": active_users_of_inactive_allocations,
+    "removed_project_user_in_allocation": removed_project_users_in_allocations,
+}
@@ -0,0 +1,67 @@
+"""
+Counters for monitoring the plugin, served at /api/metrics.
+
+Counters are kept in the Django cache backend, so they are shared between
+worker processes when the backend is (i.e Memcached or Redis), and are
+per process otherwise.
+"""
+
+from django.core.cache import cache
+
+KEY_PREFIX = "coldfront_plugin_api:metrics"
+
+# Every counter reported by `snapshot`, as "<group>.<counter>"
+COUNTERS = [
+    "allocation_cache.hits",
+    "allocation_cache.misses",
+    "oidc_token_cache.hits",
+    "oidc_token_cache.misses",
+    "user_search.hits",
+    "user_search.misses",
+    "user_search.provider_calls",
+    "user_search.provider_ms",
+]
+
+
+def _key(name):
+    return f"{KEY_PREFIX}:{name}"
+
+
+def incr(name, delta=1):
+    if not delta:
+        return
+    try:
+        cache.incr(_key(name), delta)
+    except ValueError:
+        # The counter doesn't exist yet, or has been evicted
+        cache.add(_key(name), 0, timeout=None)
+        cache.incr(_key(name), delta)
+
+
+def snapshot() -> dict:
+    """
+    Returns the counters grouped by their prefix, with the hit rate of
+    every group that counts hits and misses, and the average latency of
+    every group that times its provider calls.
+    """
+    values = cache.get_many([_key(name) for name in COUNTERS])
+
+    groups = {}
+    for name in COUNTERS:
+        group, counter = name.split(".", 1)
+        groups.setdefault(group, {})[counter] = values.get(_key(name), 0)
+
+    for counters in groups.values():
+        if "hits" in counters and "misses" in counters:
+            lookups = counters["hits"] + counters["misses"]
+            counters["hit_rate"] = counters["hits"] / lookups if lookups else None
+        if "provider_calls" in counters and "provider_ms" in counters:
+            calls = counters["provider_calls"]
+            counters["provider_avg_ms"] = (
+                counters["provider_ms"] / calls if calls else None
+            )
+    return groups
+
+
+def reset():
+    cache.delete_many([_key(name) for name in COUNTERS])
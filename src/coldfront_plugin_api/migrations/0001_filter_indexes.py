@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+
+# Indexes on ColdFront's tables backing the allocation API filters. These tables
+# belong to other apps, so the indexes are created with the schema editor rather
+# than being added to this app's migration state.
+INDEXES = [
+    ("allocation", "Allocation", ["start_date"], "cfapi_alloc_start_date_idx"),
+    ("allocation", "Allocation", ["end_date"], "cfapi_alloc_end_date_idx"),
+    ("allocation", "Allocation", ["modified"], "cfapi_alloc_modified_idx"),
+    (
+        "allocation",
+        "AllocationAttribute",
+        ["allocation_attribute_type", "value"],
+        "cfapi_alloc_attr_type_val_idx",
+    ),
+    (
+        "allocation",
+        "AllocationAttribute",
+        ["modified"],
+        "cfapi_alloc_attr_modified_idx",
+    ),
+    ("allocation", "AllocationUser", ["modified"], "cfapi_alloc_user_modified_idx"),
+    ("project", "Project", ["modified"], "cfapi_project_modified_idx"),
+    ("auth", "User", ["email"], "cfapi_user_email_idx"),
+]
+
+
+def add_indexes(apps, schema_editor):
+    for app_label, model_name, fields, name in INDEXES:
+        model = apps.get_model(app_label, model_name)
+        schema_editor.add_index(model, models.Index(fields=fields, name=name))
+
+
+def remove_indexes(apps, schema_editor):
+    for app_label, model_name, fields, name in INDEXES:
+        model = apps.get_model(app_label, model_name)
+        schema_editor.remove_index(model, models.Index(fields=fields, name=name))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("allocation", "0005_auto_20211117_1413"),
+        ("project", "0006_historicalproject_institution_project_institution"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
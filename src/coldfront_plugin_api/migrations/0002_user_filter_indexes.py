@@ -0,0 +1,34 @@
+from django.db import migrations, models
+from django.db.models.functions import Upper
+
+
+# Case insensitive indexes backing the SCIM filters on users, which compare
+# UPPER() of the columns. See `coldfront_plugin_api.scim_v2.filters`.
+INDEXES = [
+    ("username", "cfapi_user_upper_username_idx"),
+    ("email", "cfapi_user_upper_email_idx"),
+    ("first_name", "cfapi_user_upper_first_idx"),
+    ("last_name", "cfapi_user_upper_last_idx"),
+]
+
+
+def add_indexes(apps, schema_editor):
+    model = apps.get_model("auth", "User")
+    for field, name in INDEXES:
+        schema_editor.add_index(model, models.Index(Upper(field), name=name))
+
+
+def remove_indexes(apps, schema_editor):
+    model = apps.get_model("auth", "User")
+    for field, name in INDEXES:
+        schema_editor.remove_index(model, models.Index(Upper(field), name=name))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("coldfront_plugin_api", "0001_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_indexes, remove_indexes),
+    ]
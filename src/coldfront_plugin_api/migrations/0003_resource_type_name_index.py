@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+# Index backing the allocation API filter on resources__resource_type__name, so
+# that the matching resource types are found without scanning their table. The
+# joins to the resources and allocations use the indexes of their foreign keys.
+INDEX = models.Index(fields=["name"], name="cfapi_resource_type_name_idx")
+
+
+def add_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model("resource", "ResourceType"), INDEX)
+
+
+def remove_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model("resource", "ResourceType"), INDEX)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("coldfront_plugin_api", "0002_user_filter_indexes"),
+        ("resource", "0002_auto_20191017_1141"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_index, remove_index),
+    ]
@@ -0,0 +1,12 @@
+from django.db import models
+
+
+class Generation(models.Model):
+    """
+    Counter of the changes to some data, bumped by the receivers in
+    `receivers.py`. See `coldfront_plugin_api.generations`.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    value = models.BigIntegerField(default=0)
+    modified = models.DateTimeField()
@@ -0,0 +1,26 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class AllocationCursorPagination(CursorPagination):
+    """
+    Opt-in keyset pagination for allocations, ordered by id.
+
+    Pagination is only applied when the client sends a `cursor` or `page_size`
+    query parameter. Clients that send neither keep receiving the full,
+    unpaginated list of allocations.
+    """
+
+    ordering = "id"
+    page_size = settings.PLUGIN_API_ALLOCATION_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.PLUGIN_API_ALLOCATION_MAX_PAGE_SIZE
+
+    def paginate_queryset(self, queryset, request, view=None):
+        query_params = request.query_params
+        if (
+            self.cursor_query_param not in query_params
+            and self.page_size_query_param not in query_params
+        ):
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,137 @@
+"""
+Signal receivers that keep the plugin's caches consistent with the database.
+"""
+
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationAttribute,
+    AllocationAttributeType,
+    AllocationStatusChoice,
+    AllocationUser,
+    AllocationUserStatusChoice,
+    AttributeType,
+)
+from coldfront.core.field_of_science.models import FieldOfScience
+from coldfront.core.project.models import (
+    Project,
+    ProjectStatusChoice,
+    ProjectUserRoleChoice,
+    ProjectUserStatusChoice,
+)
+from coldfront.core.resource.models import Resource, ResourceType
+
+from coldfront_plugin_api import (
+    allocation_cache,
+    choices,
+    filters,
+    generations,
+    user_search_cache,
+)
+
+
+@receiver(post_save, sender=AllocationAttributeType)
+@receiver(post_delete, sender=AllocationAttributeType)
+def invalidate_attribute_type_ids(sender, **kwargs):
+    filters.invalidate_attribute_type_ids()
+
+
+@receiver(post_save, sender=Allocation)
+@receiver(post_delete, sender=Allocation)
+def invalidate_allocation(sender, instance, **kwargs):
+    allocation_cache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=AllocationAttribute)
+@receiver(post_delete, sender=AllocationAttribute)
+@receiver(post_save, sender=AllocationUser)
+@receiver(post_delete, sender=AllocationUser)
+def invalidate_allocation_of_related(sender, instance, **kwargs):
+    allocation_cache.invalidate([instance.allocation_id])
+
+
+@receiver(m2m_changed, sender=Allocation.resources.through)
+def invalidate_allocation_resources(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    if action.startswith("post_"):
+        # The resources of allocations have no modified timestamp
+        generations.bump(generations.ALLOCATIONS)
+
+    if not reverse:
+        if action.startswith("post_"):
+            allocation_cache.invalidate([instance.pk])
+    elif action in ("post_add", "post_remove"):
+        # The allocations of a resource were changed
+        allocation_cache.invalidate(pk_set)
+    elif action == "pre_clear":
+        allocation_cache.invalidate(
+            Allocation.objects.filter(resources=instance).values_list("pk", flat=True)
+        )
+
+
+@receiver(post_save, sender=Resource)
+def invalidate_resource_allocations(sender, instance, **kwargs):
+    allocation_cache.invalidate(
+        Allocation.objects.filter(resources=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=Project)
+def invalidate_project_allocations(sender, instance, **kwargs):
+    allocation_cache.invalidate(
+        Allocation.objects.filter(project=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_pi_allocations(sender, instance, update_fields=None, **kwargs):
+    # The PI's email is part of the serialized allocation. Skip the frequent
+    # saves that only record a login.
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    allocation_ids = list(
+        Allocation.objects.filter(project__pi=instance).values_list("pk", flat=True)
+    )
+    if allocation_ids:
+        allocation_cache.invalidate(allocation_ids)
+        generations.bump(generations.ALLOCATIONS)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_search(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    user_search_cache.invalidate([instance.username])
+    generations.bump(generations.USERS)
+
+
+@receiver(post_save, sender=Resource)
+@receiver(post_delete, sender=Resource)
+@receiver(post_save, sender=ResourceType)
+@receiver(post_delete, sender=ResourceType)
+@receiver(post_save, sender=FieldOfScience)
+@receiver(post_delete, sender=FieldOfScience)
+@receiver(post_save, sender=ProjectStatusChoice)
+@receiver(post_delete, sender=ProjectStatusChoice)
+@receiver(post_save, sender=AllocationStatusChoice)
+@receiver(post_delete, sender=AllocationStatusChoice)
+@receiver(post_save, sender=AllocationAttributeType)
+@receiver(post_delete, sender=AllocationAttributeType)
+@receiver(post_save, sender=AttributeType)
+@receiver(post_delete, sender=AttributeType)
+def bump_allocation_relations(sender, **kwargs):
+    generations.bump(generations.ALLOCATION_RELATIONS)
+
+
+@receiver(post_save, sender=AllocationUserStatusChoice)
+@receiver(post_delete, sender=AllocationUserStatusChoice)
+@receiver(post_save, sender=ProjectUserStatusChoice)
+@receiver(post_delete, sender=ProjectUserStatusChoice)
+@receiver(post_save, sender=ProjectUserRoleChoice)
+@receiver(post_delete, sender=ProjectUserRoleChoice)
+def invalidate_choices(sender, **kwargs):
+    choices.invalidate(sender)
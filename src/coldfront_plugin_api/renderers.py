@@ -0,0 +1,28 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils import encoders
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders data as newline delimited JSON, one object per line.
+
+    List views can stream their results by calling `render_line` for each
+    serialized object, instead of rendering the full list at once.
+    """
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = None
+    encoder_class = encoders.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if not isinstance(data, list):
+            data = [data]
+        return b"".join(self.render_line(item) for item in data)
+
+    def render_line(self, item) -> bytes:
+        return json.dumps(item, cls=self.encoder_class).encode("utf-8") + b"\n"
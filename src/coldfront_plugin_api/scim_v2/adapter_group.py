@@ -2,6 +2,14 @@ from django_scim.adapters import SCIMGroup
 from django_scim import constants, exceptions
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
+from simple_history.utils import (
+    bulk_create_with_history,
+    bulk_update_with_history,
+    get_history_manager_for_model,
+)
 from coldfront.core.allocation.models import AllocationUser, AllocationUserStatusChoice
 from coldfront.core.project.models import (
     ProjectUser,
@@ -10,7 +18,7 @@ from coldfront.core.project.models import (
 )
 from coldfront.core.allocation import signals
 
-from coldfront_plugin_api import utils
+from coldfront_plugin_api import choices, utils
 
 
 class SCIMColdfrontGroup(SCIMGroup):
@@ -29,28 +37,35 @@ class SCIMColdfrontGroup(SCIMGroup):
                 value = [x["value"] for x in operation["value"]]
 
             if operation["op"] == "add":
-                for submitted_user in value:
-                    try:
-                        user = utils.get_or_fetch_user(username=submitted_user)
-                    except ObjectDoesNotExist:
-                        raise exceptions.BadRequestError
-
-                    self._set_user_status_on_project(
-                        project, user, "Active", "User", True
-                    )
+                try:
+                    users = utils.get_or_fetch_users(value)
+                except ObjectDoesNotExist:
+                    raise exceptions.BadRequestError
 
-                    au = self._set_user_status_on_allocation(allocation, user, "Active")
+                self._set_users_status_on_project(
+                    project, users, "Active", "User", True
+                )
+
+                for au in self._set_users_status_on_allocation(
+                    allocation, users, "Active"
+                ):
                     signals.allocation_activate_user.send(
                         sender=self.__class__,
                         allocation_user_pk=au.pk,
                     )
 
             elif operation["op"] == "remove":
-                for submitted_user in value:
-                    user = User.objects.get(username=submitted_user)
-                    au = self._set_user_status_on_allocation(
-                        allocation, user, "Removed"
-                    )
+                usernames = list(dict.fromkeys(value))
+                users = {
+                    u.username: u for u in User.objects.filter(username__in=usernames)
+                }
+                for submitted_user in usernames:
+                    if submitted_user not in users:
+                        raise User.DoesNotExist(f"User {submitted_user} not found.")
+
+                for au in self._set_users_status_on_allocation(
+                    allocation, [users[u] for u in usernames], "Removed"
+                ):
                     signals.allocation_remove_user.send(
                         sender=self.__class__,
                         allocation_user_pk=au.pk,
@@ -65,52 +80,193 @@ class SCIMColdfrontGroup(SCIMGroup):
         d = {
             "schemas": [constants.SchemaURI.GROUP],
             "id": self.obj.pk,
-            "displayName": f"Members of allocation {self.obj.pk} of project {self.obj.project.title}",
-            "members": [
+        }
+
+        if self.is_attribute_requested("displayName"):
+            title = self.obj.project.title
+            d["displayName"] = f"Members of allocation {self.obj.pk} of project {title}"
+
+        # Listing the members is skipped entirely when they are not requested
+        if self.is_attribute_requested("members"):
+            d["members"] = [
                 {
-                    "value": x.user.username,
-                    "$ref": x.user.username,
-                    "display": x.user.username,
+                    "value": username,
+                    "$ref": username,
+                    "display": username,
                 }
-                for x in AllocationUser.objects.filter(
-                    allocation=self.obj, status__name="Active"
-                )
-            ],
-        }
+                for username in self.get_member_usernames()
+            ]
 
         return d
 
+    def get_member_usernames(self):
+        if hasattr(self.obj, "active_allocation_users"):
+            # Prefetched for the page of groups by prefetch_page()
+            return [au.user.username for au in self.obj.active_allocation_users]
+
+        return (
+            AllocationUser.objects.filter(allocation=self.obj, status__name="Active")
+            .order_by("pk")
+            .values_list("user__username", flat=True)
+        )
+
+    @classmethod
+    def prefetch_page(cls, groups, request=None):
+        """
+        Loads the projects and the active members of a page of groups with
+        a constant number of queries, for to_dict to use.
+        """
+        if not groups:
+            return
+
+        lookups = ["project"]
+        if cls(groups[0], request=request).is_attribute_requested("members"):
+            lookups.append(
+                Prefetch(
+                    "allocationuser_set",
+                    queryset=AllocationUser.objects.filter(status__name="Active")
+                    .select_related("user")
+                    .only("allocation_id", "user__username")
+                    .order_by("pk"),
+                    to_attr="active_allocation_users",
+                )
+            )
+        prefetch_related_objects(groups, *lookups)
+
+    def is_attribute_requested(self, name):
+        """
+        Whether the attribute should be returned according to the "attributes"
+        and "excludedAttributes" query parameters (RFC 7644, section 3.9).
+        """
+        name = name.lower()
+        if attributes := self._get_attributes_param("attributes"):
+            return any(a == name or a.startswith(f"{name}.") for a in attributes)
+        return name not in self._get_attributes_param("excludedAttributes")
+
+    def _get_attributes_param(self, param):
+        value = self._request.GET.get(param) if self._request else None
+        if not value:
+            return set()
+
+        # Attributes may be qualified with the URN of the Group schema
+        prefix = f"{constants.SchemaURI.GROUP}:".lower()
+        attributes = set()
+        for attribute in value.lower().split(","):
+            attribute = attribute.strip()
+            if attribute.startswith(prefix):
+                attribute = attribute[len(prefix) :]
+            if attribute:
+                attributes.add(attribute)
+        return attributes
+
     def from_dict(self, d):
         # Not needed. Not implemented for now
         return
 
     @staticmethod
-    def _set_user_status_on_allocation(allocation, user, status):
-        au = AllocationUser.objects.filter(allocation=allocation, user=user).first()
-        if au:
-            au.status = AllocationUserStatusChoice.objects.get(name=status)
-            au.save()
-        else:
-            au = AllocationUser.objects.create(
-                allocation=allocation,
-                user=user,
-                status=AllocationUserStatusChoice.objects.get(name=status),
+    def _set_users_status_on_allocation(allocation, users, status):
+        """Sets the status of the users on the allocation, in bulk.
+
+        Returns the AllocationUser objects in the order of the users."""
+        status = choices.get(AllocationUserStatusChoice, status)
+        now = timezone.now()
+        allocation_users = {
+            au.user_id: au
+            for au in _upsert_with_history(
+                AllocationUser.objects.filter(allocation=allocation, user__in=users),
+                [
+                    AllocationUser(
+                        allocation=allocation, user=user, status=status, modified=now
+                    )
+                    for user in users
+                ],
+                unique_fields=["allocation", "user"],
+                update_fields=["status", "modified"],
             )
-        return au
+        }
+        return [allocation_users[user.pk] for user in users]
 
     @staticmethod
-    def _set_user_status_on_project(project, user, status, role, enable_notifications):
-        pu = ProjectUser.objects.filter(project=project, user=user).first()
-
-        if pu:
-            pu.status = ProjectUserStatusChoice.objects.get(name=status)
-            pu.save()
-        else:
-            pu = ProjectUser.objects.create(
-                project=project,
-                user=user,
-                status=ProjectUserStatusChoice.objects.get(name=status),
-                role=ProjectUserRoleChoice.objects.get(name=role),
-                enable_notifications=enable_notifications,
-            )
-        return pu
+    def _set_users_status_on_project(
+        project, users, status, role, enable_notifications
+    ):
+        """Sets the status of the users on the project, in bulk.
+
+        Users who aren't on the project yet are added with the given role."""
+        status = choices.get(ProjectUserStatusChoice, status)
+        role = choices.get(ProjectUserRoleChoice, role)
+        now = timezone.now()
+        _upsert_with_history(
+            ProjectUser.objects.filter(project=project, user__in=users),
+            [
+                ProjectUser(
+                    project=project,
+                    user=user,
+                    status=status,
+                    role=role,
+                    enable_notifications=enable_notifications,
+                    modified=now,
+                )
+                for user in users
+            ],
+            unique_fields=["project", "user"],
+            # The role and notifications of existing project users are kept
+            update_fields=["status", "modified"],
+        )
+
+
+def _upsert_with_history(queryset, objs, unique_fields, update_fields):
+    """
+    Inserts the objects, updating instead the update_fields of the rows that
+    already exist with the same unique_fields, and records their history.
+
+    The rows are written with a single upsert statement, so that concurrent
+    requests for the same rows (i.e. from parallel IdP sync workers) update
+    them rather than fail on the unique constraint or create duplicates.
+    Databases without upserts lock the existing rows instead.
+
+    The queryset must match exactly the rows of the objects, and is
+    returned evaluated once they are written.
+    """
+    model = queryset.model
+    features = connections[queryset.db].features
+    history = get_history_manager_for_model(model)
+
+    with transaction.atomic(using=queryset.db, savepoint=False):
+        if not features.supports_update_conflicts:
+            existing = {
+                tuple(getattr(row, f"{field}_id") for field in unique_fields): row
+                for row in queryset.select_for_update()
+            }
+            new_objs = []
+            for obj in objs:
+                key = tuple(getattr(obj, f"{field}_id") for field in unique_fields)
+                if row := existing.get(key):
+                    for field in update_fields:
+                        setattr(row, field, getattr(obj, field))
+                else:
+                    new_objs.append(obj)
+            bulk_update_with_history(list(existing.values()), model, update_fields)
+            bulk_create_with_history(new_objs, model)
+            return list(queryset)
+
+        # The history of the rows depends on whether they existed before
+        existing_ids = set(queryset.values_list("pk", flat=True))
+        model.objects.bulk_create(
+            objs,
+            update_conflicts=True,
+            # MySQL updates on conflict with any unique constraint
+            unique_fields=(
+                unique_fields
+                if features.supports_update_conflicts_with_target
+                else None
+            ),
+            update_fields=update_fields,
+        )
+
+        rows = list(queryset)
+        history.bulk_history_create([row for row in rows if row.pk not in existing_ids])
+        history.bulk_history_create(
+            [row for row in rows if row.pk in existing_ids], update=True
+        )
+        return rows
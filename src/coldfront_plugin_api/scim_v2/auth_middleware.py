@@ -1,8 +1,8 @@
-import os
 import logging
 
 from django_scim.middleware import SCIMAuthCheckMiddleware
-from mozilla_django_oidc.contrib.drf import OIDCAuthentication
+
+from coldfront_plugin_api import auth
 
 logger = logging.getLogger(__name__)
 
@@ -14,7 +14,7 @@ class SCIMColdfrontAuthCheckMiddleware(SCIMAuthCheckMiddleware):
             # and therefore does not support authentication with bearer tokens, only
             # session cookies. We manually call `authenticate()` on the DRF backend if
             # the user is not already authenticated, and if OIDC authentication is enabled.
-            if os.getenv("PLUGIN_AUTH_OIDC") == "True":
-                if user_tuple := OIDCAuthentication().authenticate(request):
+            if auth.PLUGIN_AUTH_OIDC:
+                if user_tuple := auth.CachedOIDCAuthentication().authenticate(request):
                     request.user = user_tuple[0]
         return super().process_request(request)
@@ -1,5 +1,104 @@
+import json
+
 from django_scim.filters import UserFilterQuery, GroupFilterQuery
 from django_scim.utils import get_user_model, get_group_model
+from scim2_filter_parser import ast as scim2ast
+from scim2_filter_parser.lexer import SCIMLexer
+from scim2_filter_parser.parser import SCIMParser
+from scim2_filter_parser.queries.sql import SQLQuery
+from scim2_filter_parser.transpilers.sql import Transpiler
+
+
+class ColdfrontSCIMLexer(SCIMLexer):
+    """
+    Lexes comparison values as JSON strings (RFC 7644, section 3.4.2.2), so
+    that they may contain escaped quotes and backslashes. Invalid escapes
+    raise a ValueError, which is answered with 400 Bad Request.
+    """
+
+    tokens = SCIMLexer.tokens
+
+    @_(r'"(?:[^"\\]|\\.)*"')  # noqa: F821
+    def COMP_VALUE(self, t):
+        t.value = json.loads(t.value)
+        return t
+
+
+class _CaseInsensitiveAttrExpr(scim2ast.AttrExpr):
+    case_insensitive = True
+
+
+class ColdfrontTranspiler(Transpiler):
+    """
+    Transpiles SCIM filters into SQL, comparing every attribute case
+    insensitively, as none of the mapped attributes are case exact in the
+    SCIM schemas (RFC 7643). The comparisons are on UPPER() of the columns,
+    which is backed by the functional indexes of migration 0002.
+
+    Attributes mapped to columns of a related table, in `related_tables`, are
+    compared within a semi-join ("id IN (subquery)") on that table, so that only
+    filters referencing them pay for the join, and rows are never multiplied.
+    Unlike a correlated EXISTS, the subquery can start from the index on the
+    compared column on every database.
+    """
+
+    related_tables = {}
+
+    def visit_AttrExpr(self, node):
+        if not isinstance(node.attr_path.attr_name, scim2ast.Filter):
+            node = _CaseInsensitiveAttrExpr(
+                value=node.value, attr_path=node.attr_path, comp_value=node.comp_value
+            )
+
+        first_attr_path = len(self.attr_paths)
+        expr = super().visit_AttrExpr(node)
+        if not expr:
+            return expr
+
+        for attr_path in self.attr_paths[first_attr_path:]:
+            column = self.attr_map.get(attr_path, "")
+            if related := self.related_tables.get(column.split(".")[0]):
+                outer_column, subquery = related
+                return f"{outer_column} IN ({subquery} WHERE {expr})"
+        return expr
+
+
+class ColdfrontGroupTranspiler(ColdfrontTranspiler):
+    related_tables = {
+        "auth_user": (
+            "allocation_allocation.id",
+            "SELECT allocation_allocationuser.allocation_id"
+            " FROM allocation_allocationuser"
+            " INNER JOIN auth_user ON auth_user.id = allocation_allocationuser.user_id",
+        ),
+    }
+
+
+class ColdfrontSQLQuery(SQLQuery):
+    transpiler_class = ColdfrontTranspiler
+
+    def build_where_sql(self):
+        self.token_stream = ColdfrontSCIMLexer().tokenize(self.filter)
+        self.ast = SCIMParser().parse(self.token_stream)
+        self.transpiler = self.transpiler_class(self.attr_map)
+        self.where_sql, self.params_dict = self.transpiler.transpile(self.ast)
+
+    @property
+    def sql(self) -> str:
+        """
+        The statement selecting the rows matching the filter. The filter queries
+        have no joins, as related tables are only queried in subqueries, so each
+        row is returned once without the cost of DISTINCT.
+        """
+        lines = [f"SELECT {self.table_name}.*", f"FROM {self.table_name}"]
+        if self.where_sql:
+            placeholders = {i: self.placeholder for i in self.params_dict}
+            lines.append(f"WHERE {self.where_sql.format(**placeholders)}")
+        return "\n".join(lines) + ";"
+
+
+class ColdfrontGroupSQLQuery(ColdfrontSQLQuery):
+    transpiler_class = ColdfrontGroupTranspiler
 
 
 class ColdfrontUserFilterQuery(UserFilterQuery):
@@ -20,6 +119,7 @@ class ColdfrontUserFilterQuery(UserFilterQuery):
     """
 
     model_getter = get_user_model
+    query_class = ColdfrontSQLQuery
     attr_map = {
         # attr, sub attr, uri
         ("userName", None, None): "username",
@@ -33,15 +133,14 @@ class ColdfrontUserFilterQuery(UserFilterQuery):
 
 class ColdfrontGroupFilterQuery(GroupFilterQuery):
     """
-    Implements the attribute mapping and joins for the SCIM Group Object
+    Implements the attribute mapping for the SCIM Group Object
     Currently allows queries to filter by group (Coldfront Allocation) members
     I.e filter=members.value eq "test@bu.edu" will return all groups that user test@bu.edu belongs to
+
+    Conditions on members are translated to subqueries on the allocation users, so
+    filters that don't reference members don't join them at all.
     """
 
     model_getter = get_group_model
+    query_class = ColdfrontGroupSQLQuery
     attr_map = {("members", "value", None): "auth_user.username"}
-
-    joins = (
-        "INNER JOIN allocation_allocationuser ON allocation_allocationuser.allocation_id = allocation_allocation.id",
-        "LEFT JOIN auth_user ON auth_user.id = allocation_allocationuser.user_id",
-    )
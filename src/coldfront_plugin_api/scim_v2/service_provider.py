@@ -0,0 +1,19 @@
+"""
+Defines the SCIM service provider configuration advertised by the plugin
+"""
+
+from django.conf import settings
+from django_scim.models import SCIMServiceProviderConfig
+
+
+class ColdfrontServiceProviderConfig(SCIMServiceProviderConfig):
+    def to_dict(self):
+        d = super().to_dict()
+        d["bulk"] = {
+            "supported": True,
+            "maxOperations": settings.PLUGIN_API_SCIM_BULK_MAX_OPERATIONS,
+            "maxPayloadSize": settings.PLUGIN_API_SCIM_BULK_MAX_PAYLOAD_SIZE,
+        }
+        d["filter"]["maxResults"] = settings.PLUGIN_API_SCIM_MAX_PAGE_SIZE
+        d["etag"] = {"supported": True}
+        return d
@@ -0,0 +1,381 @@
+"""
+Defines the SCIM views for coldfront users and groups
+"""
+
+import hashlib
+import json
+import logging
+import re
+from typing import Optional
+
+from django import db
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.query import QuerySet, RawQuerySet
+from django.http import HttpResponse
+from django_scim import constants, exceptions
+from django_scim import views as scim_views
+from django_scim.settings import scim_settings
+from django_scim.utils import (
+    get_group_adapter,
+    get_group_model,
+    get_user_adapter,
+    get_user_model,
+)
+from scim2_filter_parser.parser import SCIMParserError
+
+from coldfront_plugin_api import conditional, utils
+
+logger = logging.getLogger(__name__)
+
+BULK_REQUEST_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:BulkRequest"
+BULK_RESPONSE_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:BulkResponse"
+BULK_ID_REFERENCE = re.compile(r"bulkId:([^/\s]+)")
+
+PAGINATION_KEY_PREFIX = "coldfront_plugin_api:scim_page"
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET requests with 304 Not Modified when the client's ETag still
+    matches, without serializing anything.
+    """
+
+    validators = None
+
+    def get_validators(self, request, uuid=None) -> conditional.Validators:
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators(request, kwargs.get(self.lookup_url_kwarg))
+        self.validators = validators
+        if response := conditional.get_not_modified_response(request, validators):
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        return conditional.set_validator_headers(response, validators)
+
+
+class PaginationMixin:
+    """
+    Pages SCIM list responses in the database rather than in Python.
+
+    The page is selected with LIMIT/OFFSET, or with a keyset condition on the
+    ordering field when the previous page was served from the same version of
+    the collection, so that paging sequentially through a collection costs the
+    same for every page. totalResults is a COUNT query, cached along with the
+    keys of the page boundaries for as long as the collection is unchanged.
+
+    count is capped at PLUGIN_API_SCIM_MAX_PAGE_SIZE (RFC 7644, section 3.4.2.4).
+    """
+
+    def _page(self, request):
+        start, count = super()._page(request)
+        # A negative count is interpreted as 0 (RFC 7644, section 3.4.2.4)
+        count = min(max(count, 0), settings.PLUGIN_API_SCIM_MAX_PAGE_SIZE)
+        return start, count
+
+    def _search(self, request, query, start, count):
+        if self.get_extra_filter_kwargs(request) or self.get_extra_exclude_kwargs(
+            request
+        ):
+            # The extra filters are applied to the rows of the raw query in Python
+            return super()._search(request, query, start, count)
+
+        try:
+            qs = self.__class__.parser_getter().search(query, request)
+        except (ValueError, SCIMParserError) as e:
+            raise exceptions.BadRequestError("Invalid filter/search query: " + str(e))
+
+        if isinstance(qs, RawQuerySet):
+            # Use the filter as a subquery, so that the page and count are
+            # computed by the database.
+            pk = self.model_cls._meta.pk.column
+            raw_sql = qs.raw_query.strip().rstrip(";")
+            qs = self.model_cls.objects.filter(
+                pk__in=RawSQL(
+                    f"SELECT scim_filter.{pk} FROM ({raw_sql}) scim_filter", qs.params
+                )
+            )
+        qs = qs.order_by(self.lookup_field)
+        return self._build_response(request, qs, start, count)
+
+    def _build_response(self, request, qs, start, count):
+        if not isinstance(qs, QuerySet):
+            return super()._build_response(request, qs, start, count)
+
+        key = self._get_cache_key(qs)
+        total_count = self._get_total_count(qs, key)
+        page = self._get_page(qs, start, count, key) if total_count else []
+
+        doc = {
+            "schemas": [constants.SchemaURI.LIST_RESPONSE],
+            "totalResults": total_count,
+            "itemsPerPage": count,
+            "startIndex": start,
+            "Resources": self.get_resources(request, page),
+        }
+        return HttpResponse(
+            content=json.dumps(doc), content_type=constants.SCIM_CONTENT_TYPE
+        )
+
+    def get_resources(self, request, page) -> list:
+        return [self.scim_adapter(o, request=request).to_dict() for o in page]
+
+    def _get_cache_key(self, qs) -> Optional[str]:
+        """
+        Returns the prefix of the cache keys for the queryset, or None if its
+        results can't be cached.
+        """
+        if self.validators is None or qs.query.is_empty():
+            return None
+        query = hashlib.sha256(str(qs.query).encode("utf-8")).hexdigest()
+        return f"{PAGINATION_KEY_PREFIX}:{self.validators.version}:{query}"
+
+    @staticmethod
+    def _get_total_count(qs, key) -> int:
+        if key and (total_count := cache.get(f"{key}:count")) is not None:
+            return total_count
+
+        total_count = qs.count()
+        if key:
+            cache.set(
+                f"{key}:count",
+                total_count,
+                timeout=settings.PLUGIN_API_SCIM_PAGINATION_CACHE_TIMEOUT,
+            )
+        return total_count
+
+    def _get_page(self, qs, start, count, key) -> list:
+        if count == 0:
+            return []
+
+        # The key of the last resource before startIndex, if it was on the
+        # previous page served.
+        after = cache.get(f"{key}:{start}") if key and start > 1 else None
+        if after is not None:
+            page = list(qs.filter(**{f"{self.lookup_field}__gt": after})[:count])
+        else:
+            page = list(qs[start - 1 : (start - 1) + count])
+
+        if key and page:
+            cache.set(
+                f"{key}:{start + len(page)}",
+                getattr(page[-1], self.lookup_field),
+                timeout=settings.PLUGIN_API_SCIM_PAGINATION_CACHE_TIMEOUT,
+            )
+        return page
+
+
+class ColdfrontGroupsView(ConditionalGetMixin, PaginationMixin, scim_views.GroupsView):
+    def get_validators(self, request, uuid=None):
+        queryset = self.model_cls.objects.all()
+        if uuid is not None:
+            queryset = queryset.filter(pk=uuid)
+        return conditional.group_validators(request, queryset)
+
+    def get_resources(self, request, page):
+        # The projects and members of the page of groups are loaded together
+        # rather than once per group.
+        self.scim_adapter.prefetch_page(page, request)
+        return super().get_resources(request, page)
+
+
+class ColdfrontUsersView(ConditionalGetMixin, PaginationMixin, scim_views.UsersView):
+    def get_validators(self, request, uuid=None):
+        queryset = self.model_cls.objects.all()
+        if uuid is not None:
+            queryset = queryset.filter(**{self.lookup_field: uuid})
+        return conditional.user_validators(request, queryset)
+
+
+class BulkView(scim_views.SCIMView):
+    """
+    Implements the SCIM Bulk endpoint (RFC 7644, section 3.7) for creating
+    Users and for adding and removing the members of Groups.
+
+    Operations run in order, in transactions of PLUGIN_API_SCIM_BULK_BATCH_SIZE
+    operations. A failed operation is rolled back on its own and reported in
+    the response, and processing stops once "failOnErrors" operations failed.
+
+    A "bulkId:<id>" value in the path or data of an operation is replaced with
+    the id of the user created by an earlier operation with that bulkId, so a
+    user can be created and added to a group within the same request.
+    """
+
+    http_method_names = ["post"]
+
+    def post(self, request, *args, **kwargs):
+        max_payload_size = settings.PLUGIN_API_SCIM_BULK_MAX_PAYLOAD_SIZE
+        if len(request.body) > max_payload_size:
+            raise exceptions.SCIMException(
+                f"Payload exceeds maxPayloadSize of {max_payload_size} bytes",
+                status=413,
+            )
+
+        body = self.load_body(request.body)
+        operations = body.get("Operations")
+        if body.get("schemas") != [BULK_REQUEST_SCHEMA] or not isinstance(
+            operations, list
+        ):
+            raise exceptions.BadRequestError("Invalid SCIM BulkRequest payload")
+
+        max_operations = settings.PLUGIN_API_SCIM_BULK_MAX_OPERATIONS
+        if len(operations) > max_operations:
+            raise exceptions.SCIMException(
+                f"Number of operations exceeds maxOperations of {max_operations}",
+                status=413,
+            )
+
+        fail_on_errors = body.get("failOnErrors")
+        if fail_on_errors is not None and (
+            # JSON booleans are parsed as bool, a subclass of int
+            isinstance(fail_on_errors, bool)
+            or not isinstance(fail_on_errors, int)
+            or fail_on_errors < 1
+        ):
+            raise exceptions.BadRequestError(
+                "failOnErrors must be a positive integer", scim_type="invalidValue"
+            )
+
+        # Look up the new users from the identity providers concurrently, and
+        # before any transaction is opened, so that creating them hits the cache.
+        utils.find_users(
+            op["data"]["userName"]
+            for op in operations
+            if isinstance(op, dict)
+            and op.get("method") == "POST"
+            and isinstance(op.get("data"), dict)
+            and isinstance(op["data"].get("userName"), str)
+        )
+
+        bulk_ids = {}
+        results = []
+        errors = 0
+        batch_size = settings.PLUGIN_API_SCIM_BULK_BATCH_SIZE
+        for start in range(0, len(operations), batch_size):
+            with transaction.atomic():
+                for operation in operations[start : start + batch_size]:
+                    result = self.run_operation(request, operation, bulk_ids)
+                    results.append(result)
+
+                    if "response" in result:
+                        errors += 1
+                        if fail_on_errors and errors >= fail_on_errors:
+                            break
+
+            if fail_on_errors and errors >= fail_on_errors:
+                break
+
+        content = json.dumps({"schemas": [BULK_RESPONSE_SCHEMA], "Operations": results})
+        return HttpResponse(content=content, content_type=constants.SCIM_CONTENT_TYPE)
+
+    def run_operation(self, request, operation, bulk_ids) -> dict:
+        """
+        Runs a single operation in its own savepoint and returns its result
+        in the format of the BulkResponse.
+        """
+        result = {"method": operation.get("method")}
+        if "bulkId" in operation:
+            result["bulkId"] = operation["bulkId"]
+
+        try:
+            with transaction.atomic():
+                result.update(self.handle_operation(request, operation, bulk_ids))
+        except Exception as e:
+            if not isinstance(e, exceptions.SCIMException):
+                logger.exception("Unable to complete SCIM bulk operation.")
+                if scim_settings.EXPOSE_SCIM_EXCEPTIONS:
+                    e = exceptions.SCIMException(str(e))
+                else:
+                    e = exceptions.SCIMException(
+                        "Exception occurred while processing the SCIM request"
+                    )
+            result["status"] = str(e.status)
+            result["response"] = e.to_dict()
+
+        return result
+
+    def handle_operation(self, request, operation, bulk_ids) -> dict:
+        if not isinstance(operation, dict):
+            raise exceptions.BadRequestError("Invalid SCIM bulk operation")
+
+        method = operation.get("method")
+        path = self.resolve_bulk_ids(operation.get("path") or "", bulk_ids)
+        data = self.resolve_bulk_ids(operation.get("data"), bulk_ids)
+        if not isinstance(data, dict) or not data:
+            raise exceptions.BadRequestError(f"{method} operation made without data")
+
+        resource_type, _, uuid = path.strip("/").partition("/")
+
+        if method == "POST" and resource_type == "Users" and not uuid:
+            bulk_id = operation.get("bulkId")
+            if not bulk_id:
+                raise exceptions.BadRequestError(
+                    "bulkId is required for POST operations"
+                )
+            scim_obj = self.create_user(request, data)
+            bulk_ids[bulk_id] = scim_obj.id
+            return {"location": scim_obj.location, "status": "201"}
+
+        if method == "PATCH" and resource_type == "Groups" and uuid:
+            scim_obj = self.patch_group(request, uuid, data)
+            return {"location": scim_obj.location, "status": "200"}
+
+        raise exceptions.NotImplementedError(
+            f"{method} {path} is not supported in bulk requests"
+        )
+
+    @staticmethod
+    def resolve_bulk_ids(value, bulk_ids):
+        """Replaces the bulkId references in value with the created ids."""
+        if isinstance(value, dict):
+            return {k: BulkView.resolve_bulk_ids(v, bulk_ids) for k, v in value.items()}
+        if isinstance(value, list):
+            return [BulkView.resolve_bulk_ids(v, bulk_ids) for v in value]
+        if not isinstance(value, str):
+            return value
+
+        def resolve(match):
+            if match.group(1) not in bulk_ids:
+                raise exceptions.BadRequestError(
+                    f"Unresolved reference to bulkId {match.group(1)}",
+                    scim_type="invalidValue",
+                )
+            return bulk_ids[match.group(1)]
+
+        return BULK_ID_REFERENCE.sub(resolve, value)
+
+    @staticmethod
+    def create_user(request, data):
+        scim_obj = get_user_adapter()(get_user_model()(), request=request)
+        scim_obj.validate_dict(data)
+        scim_obj.from_dict(data)
+
+        try:
+            scim_obj.save()
+        except db.utils.IntegrityError as e:
+            raise exceptions.IntegrityError(str(e))
+
+        return scim_obj
+
+    @staticmethod
+    def patch_group(request, uuid, data):
+        adapter = get_group_adapter()
+        try:
+            obj = get_group_model().objects.get(**{adapter.id_field: uuid})
+        except (ObjectDoesNotExist, ValueError):
+            raise exceptions.NotFoundError(uuid)
+
+        operations = data.get("Operations")
+        if not operations:
+            raise exceptions.BadRequestError(
+                "PATCH operation made without operations array"
+            )
+
+        scim_obj = adapter(obj, request=request)
+        scim_obj.handle_operations(operations)
+        return scim_obj
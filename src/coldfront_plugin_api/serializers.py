@@ -1,7 +1,35 @@
+import functools
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import OuterRef, Prefetch, Subquery, prefetch_related_objects
+from django.db.models.functions import JSONObject
 from rest_framework import serializers
 
+from coldfront.core import attribute_expansion
 from coldfront.core.allocation.models import Allocation, AllocationAttribute
 from coldfront.core.allocation.models import Project
+from coldfront.core.resource.models import Resource
+
+
+@functools.lru_cache(maxsize=None)
+def get_coercer(type_name):
+    """
+    Returns a function converting attribute values of the given attribute type
+    (i.e. "Int") to the same Python value as `attribute_expansion.convert_type`.
+    """
+    for suffix, convert in (("Text", str), ("Int", int), ("Float", float)):
+        if type_name.endswith(suffix):
+
+            def coerce(value, convert=convert):
+                try:
+                    return convert(value)
+                except ValueError:
+                    # Logs the error and returns the value unchanged
+                    return attribute_expansion.convert_type(value, type_name)
+
+            return coerce
+    return lambda value: value
 
 
 class ProjectSerializer(serializers.ModelSerializer):
@@ -33,18 +61,169 @@ class AllocationSerializer(serializers.ModelSerializer):
     attributes = serializers.SerializerMethodField()
     status = serializers.SerializerMethodField()
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, attribute_type_ids=None):
+        """
+        Loads every relation used by the serializer up front, so that
+        serializing any number of allocations costs a constant number of queries.
+
+        Only the relations of the given fields are loaded. Attributes are loaded
+        with load_attributes, or aggregated into the query on PostgreSQL when
+        PLUGIN_API_ALLOCATION_ATTRIBUTES_AGGREGATE is enabled, only of the given
+        types when set.
+        """
+        fields = set(cls.Meta.fields if fields is None else fields)
+
+        select_related = []
+        if "status" in fields:
+            select_related.append("status")
+        if "project" in fields:
+            select_related += [
+                "project__pi",
+                "project__field_of_science",
+                "project__status",
+            ]
+
+        prefetch_related = []
+        if "resource" in fields:
+            prefetch_related.append(
+                Prefetch(
+                    "resources",
+                    queryset=Resource.objects.select_related("resource_type"),
+                )
+            )
+        if (
+            "attributes" in fields
+            and settings.PLUGIN_API_ALLOCATION_ATTRIBUTES_AGGREGATE
+            and connection.vendor == "postgresql"
+        ):
+            # Requires psycopg, so only imported when running on PostgreSQL
+            from django.contrib.postgres.aggregates import JSONBAgg
+
+            attributes = AllocationAttribute.objects.filter(allocation=OuterRef("pk"))
+            if attribute_type_ids is not None:
+                attributes = attributes.filter(
+                    allocation_attribute_type_id__in=attribute_type_ids
+                )
+            rows = JSONBAgg(
+                JSONObject(
+                    pk="pk",
+                    name="allocation_attribute_type__name",
+                    value="value",
+                    type="allocation_attribute_type__attribute_type__name",
+                ),
+                ordering="pk",
+            )
+            queryset = queryset.annotate(
+                attribute_rows=Subquery(
+                    attributes.order_by()
+                    .values("allocation")
+                    .annotate(rows=rows)
+                    .values("rows")
+                )
+            )
+
+        if select_related:
+            # Without arguments, select_related() would follow every relation
+            queryset = queryset.select_related(*select_related)
+        return queryset.prefetch_related(*prefetch_related)
+
     def get_resource(self, obj: Allocation) -> dict:
-        resource = obj.resources.first()
+        # Same ordering as resources.first(), but served from the prefetch cache
+        resource = next(iter(obj.resources.all()))
         return {"name": resource.name, "resource_type": resource.resource_type.name}
 
-    def get_attributes(self, obj: Allocation):
-        attrs = AllocationAttribute.objects.filter(allocation=obj)
-        return {
-            a.allocation_attribute_type.name: obj.get_attribute(
-                a.allocation_attribute_type.name
+    @staticmethod
+    def load_attributes(allocations, attribute_type_ids=None, queryset=None):
+        """
+        Sets the `attribute_map` of the allocations, of the attributes of the
+        given types if set. The attributes are read from the `attribute_rows`
+        aggregated by setup_eager_loading, or otherwise with a single query,
+        filtered on the queryset the allocations were read from if given rather
+        than on their ids.
+
+        The values are converted as obj.get_attribute(name) would, which returns
+        the value of the first attribute (by pk) with that name.
+        """
+        rows = {}
+        missing_ids = []
+        for allocation in allocations:
+            if hasattr(allocation, "attribute_rows"):
+                rows[allocation.pk] = [
+                    (row["pk"], row["name"], row["value"], row["type"])
+                    for row in allocation.attribute_rows or []
+                ]
+            else:
+                missing_ids.append(allocation.pk)
+
+        if missing_ids:
+            if queryset is not None and len(missing_ids) == len(allocations):
+                attributes = AllocationAttribute.objects.filter(
+                    allocation__in=queryset.values("pk")
+                )
+            else:
+                attributes = AllocationAttribute.objects.filter(
+                    allocation_id__in=missing_ids
+                )
+            if attribute_type_ids is not None:
+                attributes = attributes.filter(
+                    allocation_attribute_type_id__in=attribute_type_ids
+                )
+            for allocation_id, *row in attributes.order_by("pk").values_list(
+                "allocation_id",
+                "pk",
+                "allocation_attribute_type__name",
+                "value",
+                "allocation_attribute_type__attribute_type__name",
+            ):
+                rows.setdefault(allocation_id, []).append(row)
+
+        # Expanded attributes depend on other attributes and resources, so
+        # they are still expanded by the model.
+        expandable = []
+        for allocation in allocations:
+            attrs = {}
+            for pk, name, value, type_name in rows.get(allocation.pk, []):
+                if name in attrs:
+                    continue
+                if type_name.startswith(
+                    attribute_expansion.ATTRIBUTE_EXPANSION_TYPE_PREFIX
+                ):
+                    expandable.append((allocation, attrs, name, pk))
+                    attrs[name] = None
+                else:
+                    attrs[name] = get_coercer(type_name)(value)
+            allocation.attribute_map = attrs
+
+        if expandable:
+            # Expansion reads the other attributes of the allocations
+            attributes = AllocationAttribute.objects.select_related(
+                "allocation_attribute_type__attribute_type"
+            ).order_by("pk")
+            prefetch_related_objects(
+                list({id(a): a for a, *_ in expandable}.values()),
+                Prefetch("allocationattribute_set", queryset=attributes),
             )
-            for a in attrs
-        }
+            instances = {
+                a.pk: a
+                for allocation, *_ in expandable
+                for a in allocation.allocationattribute_set.all()
+            }
+            for allocation, attrs, name, pk in expandable:
+                # Reuses the resources prefetched for the allocation
+                instances[pk].allocation = allocation
+                attrs[name] = instances[pk].expanded_value()
+
+    def get_attributes(self, obj: Allocation):
+        if not hasattr(obj, "attribute_map"):
+            self.load_attributes([obj])
+        return obj.attribute_map
 
     def get_status(self, obj: Allocation) -> str:
         return obj.status.name
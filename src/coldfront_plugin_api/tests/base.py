@@ -17,11 +17,14 @@ from coldfront.core.project.models import (
     ProjectUserStatusChoice,
     ProjectStatusChoice,
 )
+from django.core.cache import cache
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
+from coldfront_plugin_api import choices, user_search_cache
 
-class TestBase(TestCase):
+
+class TestBaseMixin:
     def setUp(self) -> None:
         # Otherwise output goes to the terminal for every test that is run
         backup, sys.stdout = sys.stdout, open(devnull, "a")
@@ -29,6 +32,9 @@ class TestBase(TestCase):
         call_command("load_test_data")
         call_command("register_cloud_attributes")
         sys.stdout = backup
+        cache.clear()
+        user_search_cache.clear()
+        choices.clear()
 
     @staticmethod
     def new_user(username=None) -> User:
@@ -73,3 +79,16 @@ class TestBase(TestCase):
             status=AllocationUserStatusChoice.objects.get(name="Active"),
         )
         return au
+
+
+class TestBase(TestBaseMixin, TestCase):
+    pass
+
+
+class TransactionTestBase(TestBaseMixin, TransactionTestCase):
+    """
+    For tests of code that reads the database from other processes, which
+    can't see the data in the transaction wrapping every TestCase test.
+    """
+
+    serialized_rollback = True
@@ -5,7 +5,14 @@ FAKE_USERS = {
         "last_name": "user 1",
         "email": "fake_user_1@example.com",
         "source": "Fake Source",
-    }
+    },
+    "fake-user-2": {
+        "username": "fake-user-2",
+        "first_name": "fake",
+        "last_name": "user 2",
+        "email": "fake_user_2@example.com",
+        "source": "Fake Source",
+    },
 }
 
 
@@ -1,8 +1,17 @@
+import json
 from os import devnull
 import sys
+import time
 
 from coldfront.core.allocation import models as allocation_models
+from django.core.cache import cache
 from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from coldfront_plugin_api import checks
 from coldfront_plugin_cloud.tests import base
 from coldfront_plugin_cloud import attributes
 from rest_framework.test import APIClient
@@ -16,6 +25,7 @@ class TestAllocation(base.TestBase):
         call_command("load_test_data")
         call_command("register_cloud_attributes")
         sys.stdout = backup
+        cache.clear()
 
         self.resource = self.new_openstack_resource(
             name="Devstack", auth_url="http://localhost"
@@ -50,6 +60,86 @@ class TestAllocation(base.TestBase):
         for allocation in response.json():
             self.assertEqual(allocation["status"], "Active")
 
+    def test_list_allocations_query_count(self):
+        client = self.admin_client
+
+        def new_allocation_with_attributes():
+            allocation = self.new_allocation(
+                self.new_project(pi=self.new_user()), self.resource, 1
+            )
+            self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_CPU, 2)
+            self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_MEMORY, 4)
+            return allocation
+
+        def list_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                response = client.get("/api/allocations?all=true")
+            self.assertEqual(response.status_code, 200)
+            return [query["sql"] for query in ctx.captured_queries]
+
+        def attribute_queries(queries):
+            return [sql for sql in queries if "allocation_allocationattribute" in sql]
+
+        new_allocation_with_attributes()
+        queries = list_queries()
+
+        for _ in range(5):
+            new_allocation_with_attributes()
+
+        # Listing more allocations must not issue more queries
+        more_queries = list_queries()
+        self.assertEqual(len(queries), len(more_queries))
+        # Nor send their ids back to the database
+        self.assertEqual(attribute_queries(queries), attribute_queries(more_queries))
+
+    @override_settings(PLUGIN_API_ALLOCATION_CACHE=True)
+    def test_list_allocations_cached(self):
+        allocation = self.new_allocation(
+            self.new_project(pi=self.new_user()), self.resource, 1
+        )
+        aa = self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_CPU, 1)
+        client = self.admin_client
+
+        def get_allocations():
+            with CaptureQueriesContext(connection) as ctx:
+                r_json = client.get("/api/allocations").json()
+            return r_json, len(ctx.captured_queries)
+
+        r_json, uncached_queries = get_allocations()
+        cached_json, cached_queries = get_allocations()
+        self.assertEqual(r_json, cached_json)
+        self.assertLess(cached_queries, uncached_queries)
+
+        r_json = client.get("/api/metrics").json()
+        self.assertEqual(r_json["allocation_cache"]["misses"], len(cached_json))
+        self.assertEqual(r_json["allocation_cache"]["hits"], len(cached_json))
+
+        # Changes to an attribute invalidate the cached allocation
+        aa.value = 2
+        aa.save()
+        r_json = client.get(f"/api/allocations/{allocation.id}").json()
+        self.assertEqual(r_json["attributes"][attributes.QUOTA_LIMITS_CPU], 2)
+
+        # So do changes to the objects shared by many allocations
+        resource_type = self.resource.resource_type
+        resource_type.name = f"{resource_type.name} renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            resource_type.save()
+        r_json = client.get(f"/api/allocations/{allocation.id}").json()
+        self.assertEqual(r_json["resource"]["resource_type"], resource_type.name)
+
+        # The cache requires a cache backend shared between processes
+        with override_settings(
+            CACHES={
+                "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+            }
+        ):
+            self.assertEqual(
+                [w.id for w in checks.check_allocation_cache(None)],
+                ["coldfront_plugin_api.W001"],
+            )
+
     def test_list_all_allocations(self):
         user = self.new_user()
         project = self.new_project(pi=user)
@@ -70,6 +160,259 @@ class TestAllocation(base.TestBase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(allocation.id, [a["id"] for a in response.json()])
 
+    def test_paginate_allocations(self):
+        for _ in range(3):
+            self.new_allocation(self.new_project(pi=self.new_user()), self.resource, 1)
+
+        all_ids = [a["id"] for a in self.admin_client.get("/api/allocations").json()]
+
+        # Walk all the pages by following the next links
+        paginated_ids = []
+        url = "/api/allocations?page_size=2"
+        while url:
+            r_json = self.admin_client.get(url).json()
+            self.assertLessEqual(len(r_json["results"]), 2)
+            paginated_ids += [a["id"] for a in r_json["results"]]
+            url = r_json["next"]
+
+        self.assertEqual(paginated_ids, sorted(all_ids))
+
+    def test_stream_allocations_ndjson(self):
+        for _ in range(3):
+            self.new_allocation(self.new_project(pi=self.new_user()), self.resource, 1)
+
+        expected = self.admin_client.get("/api/allocations").json()
+
+        response = self.admin_client.get("/api/allocations?format=ndjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], expected)
+
+        response = self.admin_client.get(
+            "/api/allocations", HTTP_ACCEPT="application/x-ndjson"
+        )
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).splitlines()
+        self.assertEqual(len(lines), len(expected))
+
+        # The ETag of the JSON list doesn't match the streamed one
+        response = self.admin_client.get("/api/allocations")
+        self.assertIn("Accept", response["Vary"])
+        etag = response["ETag"]
+        response = self.admin_client.get(
+            "/api/allocations",
+            HTTP_ACCEPT="application/x-ndjson",
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        response = self.admin_client.get(
+            "/api/allocations",
+            HTTP_ACCEPT="application/x-ndjson",
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertIn("Accept", response["Vary"])
+
+    def test_list_allocations_attribute_values(self):
+        allocation = self.new_allocation(
+            self.new_project(pi=self.new_user()), self.resource, 1
+        )
+        # Int, with a value that can't be converted, and Text
+        self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_CPU, "2")
+        self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_MEMORY, "x")
+        self.new_allocation_attribute(
+            allocation, attributes.ALLOCATION_PROJECT_NAME, "123"
+        )
+
+        r_json = self.admin_client.get(f"/api/allocations/{allocation.id}").json()
+        for name, value in r_json["attributes"].items():
+            self.assertEqual(value, allocation.get_attribute(name))
+            self.assertIs(type(value), type(allocation.get_attribute(name)))
+        self.assertEqual(r_json["attributes"][attributes.QUOTA_LIMITS_CPU], 2)
+        self.assertEqual(r_json["attributes"][attributes.QUOTA_LIMITS_MEMORY], "x")
+        self.assertEqual(
+            r_json["attributes"][attributes.ALLOCATION_PROJECT_NAME], "123"
+        )
+
+    @override_settings(PLUGIN_API_ALLOCATION_CACHE=True)
+    def test_list_allocations_fields(self):
+        allocation = self.new_allocation(
+            self.new_project(pi=self.new_user()), self.resource, 1
+        )
+        self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_CPU, 2)
+        self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_MEMORY, 4)
+        client = self.admin_client
+
+        def get_allocation(query):
+            cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                r_json = client.get(f"/api/allocations?{query}").json()
+            return [a for a in r_json if a.get("id") == allocation.id], ctx
+
+        [full], full_ctx = get_allocation("")
+
+        [sparse], sparse_ctx = get_allocation("fields=id,status")
+        self.assertEqual(sparse, {"id": allocation.id, "status": "Active"})
+        self.assertLess(
+            len(sparse_ctx.captured_queries), len(full_ctx.captured_queries)
+        )
+        # Relations that aren't returned are never queried
+        sql = " ".join(q["sql"] for q in sparse_ctx.captured_queries)
+        self.assertNotIn("project_project", sql)
+        self.assertNotIn("allocation_allocationattribute", sql)
+
+        [sparse], _ = get_allocation(
+            f"fields=id,attributes&attributes={attributes.QUOTA_LIMITS_CPU.upper()}"
+        )
+        self.assertEqual(
+            sparse,
+            {
+                "id": allocation.id,
+                "attributes": {attributes.QUOTA_LIMITS_CPU: 2},
+            },
+        )
+
+        [sparse], _ = get_allocation(f"attributes={attributes.QUOTA_LIMITS_MEMORY}")
+        self.assertEqual(sparse["project"], full["project"])
+        self.assertEqual(sparse["attributes"], {attributes.QUOTA_LIMITS_MEMORY: 4})
+
+        # Partial allocations are not cached
+        client.get("/api/allocations?fields=id")
+        r_json = client.get("/api/allocations").json()
+        self.assertIn(full, r_json)
+
+        response = client.get("/api/allocations?fields=id,fake")
+        self.assertEqual(response.status_code, 400)
+
+    def test_filter_allocations_allowlist(self):
+        user = self.new_user()
+        allocation1 = self.new_allocation(self.new_project(pi=user), self.resource, 1)
+        allocation2 = self.new_allocation(self.new_project(pi=user), self.resource, 1)
+
+        r_json = self.admin_client.get(
+            f"/api/allocations?id__in={allocation1.id},{allocation2.id}"
+        ).json()
+        self.assertEqual(
+            sorted(a["id"] for a in r_json), sorted([allocation1.id, allocation2.id])
+        )
+
+        r_json = self.admin_client.get(
+            f"/api/allocations?project__pi__email={user.email}&id__gt={allocation1.id}"
+        ).json()
+        self.assertEqual([a["id"] for a in r_json], [allocation2.id])
+
+        # Lookups outside of the allowlist return an empty list
+        for query in [
+            f"project__pi__email__icontains={user.email}",
+            f"project__pi__first_name={user.first_name}",
+            "id__regex=.*",
+            "id=invalid",
+        ]:
+            r_json = self.admin_client.get(f"/api/allocations?{query}").json()
+            self.assertEqual(r_json, [])
+
+    def test_filter_allocations_by_attribute_name_case(self):
+        allocation = self.new_allocation(
+            self.new_project(pi=self.new_user()), self.resource, 1
+        )
+        self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_CPU, 5)
+        self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_MEMORY, 5)
+
+        r_json = self.admin_client.get(
+            "/api/allocations",
+            {
+                f"attr_{attributes.QUOTA_LIMITS_CPU.upper()}": [5, 6],
+                f"attr_{attributes.QUOTA_LIMITS_MEMORY.lower()}": 5,
+            },
+        ).json()
+        self.assertEqual([a["id"] for a in r_json], [allocation.id])
+
+    def test_modified_since_allocations(self):
+        project1 = self.new_project(pi=self.new_user())
+        project2 = self.new_project(pi=self.new_user())
+        allocation1 = self.new_allocation(project1, self.resource, 1)
+        allocation2 = self.new_allocation(project2, self.resource, 1)
+        aa = self.new_allocation_attribute(allocation1, attributes.QUOTA_LIMITS_CPU, 1)
+        since = {"modified_since": timezone.now().isoformat()}
+
+        r_json = self.admin_client.get("/api/allocations", since).json()
+        self.assertEqual(r_json, [])
+
+        # A changed attribute marks its allocation as modified
+        aa.value = 2
+        aa.save()
+        r_json = self.admin_client.get("/api/allocations", since).json()
+        self.assertEqual([a["id"] for a in r_json], [allocation1.id])
+
+        # So does a change to the allocation's project
+        project2.save()
+        r_json = self.admin_client.get("/api/allocations", since).json()
+        self.assertEqual(
+            sorted(a["id"] for a in r_json), sorted([allocation1.id, allocation2.id])
+        )
+
+        response = self.admin_client.get("/api/allocations?modified_since=fake")
+        self.assertEqual(response.status_code, 400)
+
+    def test_conditional_list_allocations(self):
+        allocation = self.new_allocation(
+            self.new_project(pi=self.new_user()), self.resource, 1
+        )
+        aa = self.new_allocation_attribute(allocation, attributes.QUOTA_LIMITS_CPU, 1)
+
+        for url in ["/api/allocations", f"/api/allocations/{allocation.id}"]:
+            response = self.admin_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+            response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+            # Changing an attribute changes the validators
+            aa.value = int(aa.value) + 1
+            aa.save()
+            response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+        # Changing the PI changes the validators, though it has no timestamp
+        url = f"/api/allocations/{allocation.id}"
+        etag = self.admin_client.get(url)["ETag"]
+        pi = allocation.project.pi
+        pi.email = f"new-{pi.email}"
+        with self.captureOnCommitCallbacks(execute=True):
+            pi.save()
+        response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["project"]["pi"], pi.email)
+
+        # There is no Last-Modified, as deleted rows don't advance it
+        response = self.admin_client.get(url)
+        self.assertNotIn("Last-Modified", response)
+        etag = response["ETag"]
+        aa.delete()
+        response = self.admin_client.get(
+            url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(attributes.QUOTA_LIMITS_CPU, response.json()["attributes"])
+
+        response = self.admin_client.get("/api/allocations")
+        self.assertNotIn("Last-Modified", response)
+        etag = response["ETag"]
+
+        allocation.status = allocation_models.AllocationStatusChoice.objects.get(
+            name="Expired"
+        )
+        allocation.save()
+        response = self.admin_client.get("/api/allocations", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(allocation.id, [a["id"] for a in response.json()])
+
     def test_filter_allocations(self):
         user1 = self.new_user()
         project1 = self.new_project(pi=user1)
@@ -0,0 +1,55 @@
+import base64
+import json
+import time
+from unittest import mock
+
+from django.test import RequestFactory
+from mozilla_django_oidc.auth import OIDCAuthenticationBackend
+
+from coldfront_plugin_api import auth
+from coldfront_plugin_api.tests import base
+
+
+def get_token(**claims):
+    def encode(d):
+        return base64.urlsafe_b64encode(json.dumps(d).encode()).decode().rstrip("=")
+
+    return f"{encode({'alg': 'RS256'})}.{encode(claims)}.signature"
+
+
+class TestCachedOIDCAuthentication(base.TestBase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.user = self.new_user()
+        self.backend = mock.Mock(spec=OIDCAuthenticationBackend)
+        self.backend.get_or_create_user.return_value = self.user
+
+    def authenticate(self, token):
+        request = RequestFactory().get("/", HTTP_AUTHORIZATION=f"Bearer {token}")
+        return auth.CachedOIDCAuthentication(backend=self.backend).authenticate(request)
+
+    def test_token_cached(self):
+        token = get_token(exp=int(time.time()) + 3600)
+        for _ in range(3):
+            self.assertEqual(self.authenticate(token), (self.user, token))
+        self.assertEqual(self.backend.get_or_create_user.call_count, 1)
+
+        # A deactivated user is validated again with the identity provider
+        self.user.is_active = False
+        self.user.save()
+        self.authenticate(token)
+        self.assertEqual(self.backend.get_or_create_user.call_count, 2)
+
+    def test_expired_token_not_cached(self):
+        token = get_token(exp=int(time.time()) - 10)
+        for _ in range(2):
+            self.assertEqual(self.authenticate(token), (self.user, token))
+        self.assertEqual(self.backend.get_or_create_user.call_count, 2)
+
+    def test_token_timeout(self):
+        with self.settings(PLUGIN_API_OIDC_TOKEN_CACHE_TIMEOUT=300):
+            self.assertEqual(auth._get_token_timeout("opaque-token"), 300)
+            self.assertEqual(auth._get_token_timeout(get_token()), 300)
+            self.assertLessEqual(
+                auth._get_token_timeout(get_token(exp=int(time.time()) + 60)), 60
+            )
@@ -0,0 +1,156 @@
+from unittest import mock
+import uuid
+
+from coldfront.core.allocation.models import AllocationUser
+from coldfront.core.resource import models as resource_models
+from coldfront.core.user.models import User
+from coldfront_plugin_api.tests import base
+from rest_framework.test import APIClient
+
+from coldfront_plugin_api.tests.unit import fakes
+
+
+def get_user_operation(username, bulk_id):
+    return {
+        "method": "POST",
+        "path": "/Users",
+        "bulkId": bulk_id,
+        "data": {
+            "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+            "userName": username,
+            "name": {"givenName": "Test", "familyName": username},
+            "emails": [{"value": f"{username}@example.com", "primary": True}],
+        },
+    }
+
+
+def get_group_operation(allocation_id, op, usernames):
+    return {
+        "method": "PATCH",
+        "path": f"/Groups/{allocation_id}",
+        "data": {
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [
+                {"op": op, "value": {"members": [{"value": u} for u in usernames]}}
+            ],
+        },
+    }
+
+
+def get_payload(operations, **kwargs):
+    return {
+        "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkRequest"],
+        "Operations": operations,
+        **kwargs,
+    }
+
+
+class TestBulk(base.TestBase):
+    def setUp(self) -> None:
+        self.maxDiff = None
+        super().setUp()
+        self.resource = resource_models.Resource.objects.all().first()
+
+    @property
+    def admin_client(self):
+        client = APIClient()
+        client.login(username="admin", password="test1234")
+        return client
+
+    @property
+    def logged_in_user_client(self):
+        client = APIClient()
+        client.login(username="cgray", password="test1234")
+        return client
+
+    @mock.patch("coldfront.core.user.utils.CombinedUserSearch", fakes.FakeUserSearch)
+    def test_bulk_create_users_and_add_to_group(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+
+        usernames = [uuid.uuid4().hex for _ in range(3)]
+        operations = [
+            get_user_operation(u, f"user{i}") for i, u in enumerate(usernames)
+        ]
+        operations.append(
+            get_group_operation(
+                allocation.id,
+                "add",
+                [f"bulkId:user{i}" for i in range(3)] + ["fake-user-1"],
+            )
+        )
+
+        response = self.admin_client.post(
+            "/api/scim/v2/Bulk", data=get_payload(operations), format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["Operations"]
+        self.assertEqual([r["status"] for r in results], ["201", "201", "201", "200"])
+        self.assertEqual(results[0]["bulkId"], "user0")
+        self.assertTrue(results[0]["location"].endswith(f"/Users/{usernames[0]}"))
+
+        self.assertEqual(User.objects.filter(username__in=usernames).count(), 3)
+        self.assertEqual(
+            sorted(
+                AllocationUser.objects.filter(
+                    allocation=allocation, status__name="Active"
+                ).values_list("user__username", flat=True)
+            ),
+            sorted(usernames + ["fake-user-1"]),
+        )
+
+    def test_bulk_fail_on_errors(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+
+        operations = [
+            get_group_operation(allocation.id, "add", [user.username]),
+            get_group_operation(999999, "add", [user.username]),
+            get_group_operation(allocation.id, "add", ["bulkId:missing"]),
+            get_group_operation(allocation.id, "remove", [user.username]),
+        ]
+
+        response = self.admin_client.post(
+            "/api/scim/v2/Bulk",
+            data=get_payload(operations, failOnErrors=2),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["Operations"]
+        self.assertEqual([r["status"] for r in results], ["200", "404", "400"])
+
+        # The failed operations don't roll back the successful ones
+        self.assertTrue(
+            AllocationUser.objects.filter(
+                allocation=allocation, user=user, status__name="Active"
+            ).exists()
+        )
+
+        for fail_on_errors in [0, -1, "2", True, False]:
+            response = self.admin_client.post(
+                "/api/scim/v2/Bulk",
+                data=get_payload(operations, failOnErrors=fail_on_errors),
+                format="json",
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_bulk_limits(self):
+        with self.settings(PLUGIN_API_SCIM_BULK_MAX_OPERATIONS=1):
+            operations = [get_user_operation(uuid.uuid4().hex, i) for i in "ab"]
+            response = self.admin_client.post(
+                "/api/scim/v2/Bulk", data=get_payload(operations), format="json"
+            )
+            self.assertEqual(response.status_code, 413)
+
+        response = self.admin_client.get("/api/scim/v2/ServiceProviderConfig")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["bulk"]["supported"])
+        self.assertEqual(response.json()["bulk"]["maxOperations"], 1000)
+
+    def test_normal_user_forbidden(self):
+        response = self.logged_in_user_client.post(
+            "/api/scim/v2/Bulk", data=get_payload([]), format="json"
+        )
+        self.assertEqual(response.status_code, 403)
@@ -1,3 +1,5 @@
+from io import StringIO
+
 from django.core.management import call_command
 
 from coldfront.core.allocation.models import (
@@ -41,3 +43,38 @@ class TestFixAllocation(base.TestBase):
         call_command("fix_allocation_users", "--apply")
         p_user = ProjectUser.objects.filter(project=project).filter(user=user)
         self.assertTrue(p_user.exists())
+
+    @patch("coldfront_plugin_api.management.commands.fix_allocation_users.logger")
+    def test_command_apply_batched(self, mock_logger):
+        allocation = Allocation.objects.first()
+        other_allocation = self.new_allocation(
+            allocation.project, allocation.resources.first(), 1
+        )
+        users = [self.new_user() for _ in range(3)]
+        for user in users:
+            for a in [allocation, other_allocation]:
+                AllocationUser.objects.create(
+                    user=user,
+                    allocation=a,
+                    status=AllocationUserStatusChoice.objects.get(name="Active"),
+                )
+
+        out = StringIO()
+        call_command("fix_allocation_users", stdout=out)
+        self.assertIn("Found 3 users", out.getvalue())
+        self.assertEqual(6, mock_logger.warn.call_count)
+
+        out = StringIO()
+        call_command("fix_allocation_users", "--apply", "--batch-size=2", stdout=out)
+        self.assertIn("Added 3 users", out.getvalue())
+        project_users = ProjectUser.objects.filter(
+            project=allocation.project, user__in=users, status__name="Active"
+        )
+        self.assertEqual(3, project_users.count())
+        self.assertEqual(
+            3, ProjectUser.history.filter(id__in=project_users.values("id")).count()
+        )
+
+        out = StringIO()
+        call_command("fix_allocation_users", stdout=out)
+        self.assertIn("Found 0 users", out.getvalue())
@@ -1,8 +1,20 @@
+import time
 from unittest import mock
 import uuid
 
+from coldfront.core.allocation import signals
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationUser,
+    AllocationUserStatusChoice,
+)
+from django.contrib.auth.models import User
+from coldfront.core.project.models import ProjectUser
 from coldfront.core.resource import models as resource_models
+from coldfront_plugin_api import choices
 from coldfront_plugin_api.tests import base
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
 from coldfront_plugin_api.tests.unit import fakes
@@ -49,6 +61,38 @@ class TestAllocation(base.TestBase):
         self.assertEqual(response.status_code, 200)
         self.assertIn(desired_in_response, response.json()["Resources"])
 
+    def test_list_groups_query_count(self):
+        def count_list_queries():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.admin_client.get("/api/scim/v2/Groups?count=100")
+            self.assertEqual(response.status_code, 200)
+            return len(queries), response.json()["Resources"]
+
+        def new_allocations(n):
+            for _ in range(n):
+                user = self.new_user()
+                project = self.new_project(pi=user)
+                allocation = self.new_allocation(project, self.resource, 1)
+                for _ in range(3):
+                    self.new_allocation_user(allocation, self.new_user())
+
+        new_allocations(5)
+        queries, groups = count_list_queries()
+
+        # The number of queries doesn't grow with the number of groups
+        new_allocations(20)
+        self.assertEqual(count_list_queries()[0], queries)
+
+        groups = {g["id"]: g for g in count_list_queries()[1]}
+        for allocation in Allocation.objects.all():
+            members = AllocationUser.objects.filter(
+                allocation=allocation, status__name="Active"
+            ).order_by("pk")
+            self.assertEqual(
+                [m["value"] for m in groups[allocation.id]["members"]],
+                [m.user.username for m in members],
+            )
+
     def test_get_group(self):
         user = self.new_user()
         project = self.new_project(pi=user)
@@ -64,6 +108,65 @@ class TestAllocation(base.TestBase):
         }
         self.assertEqual(response.json(), desired_response)
 
+    def test_get_group_not_modified(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+
+        for url in ["/api/scim/v2/Groups", f"/api/scim/v2/Groups/{allocation.id}"]:
+            response = self.admin_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+            response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+        # Adding a member changes the validators
+        self.new_allocation_user(allocation, user)
+        response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["members"]), 1)
+
+    def test_get_group_attributes(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+        self.new_allocation_user(allocation, user)
+        display_name = (
+            f"Members of allocation {allocation.id} of project {project.title}"
+        )
+        members = [
+            {"value": user.username, "$ref": user.username, "display": user.username}
+        ]
+
+        url = f"/api/scim/v2/Groups/{allocation.id}"
+        response = self.admin_client.get(f"{url}?excludedAttributes=members")
+        self.assertEqual(
+            response.json(),
+            {
+                "schemas": ["urn:ietf:params:scim:schemas:core:2.0:Group"],
+                "id": allocation.id,
+                "displayName": display_name,
+            },
+        )
+
+        response = self.admin_client.get(f"{url}?attributes=members.value")
+        self.assertEqual(response.json()["members"], members)
+        self.assertNotIn("displayName", response.json())
+
+        response = self.admin_client.get(
+            "/api/scim/v2/Groups?count=1000&attributes="
+            "urn:ietf:params:scim:schemas:core:2.0:Group:displayName"
+        )
+        self.assertIn(
+            {
+                "schemas": ["urn:ietf:params:scim:schemas:core:2.0:Group"],
+                "id": allocation.id,
+                "displayName": display_name,
+            },
+            response.json()["Resources"],
+        )
+
     def test_add_remove_group_members(self):
         user = self.new_user()
         project = self.new_project(pi=user)
@@ -121,6 +224,159 @@ class TestAllocation(base.TestBase):
         )
         self.assertEqual(response.status_code, 200)
 
+    @mock.patch("coldfront.core.user.utils.CombinedUserSearch", fakes.FakeUserSearch)
+    def test_add_remove_multiple_group_members(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+        existing = [self.new_user() for _ in range(3)]
+        self.new_project_user(existing[0], project)
+        self.new_allocation_user(allocation, existing[0])
+
+        usernames = [u.username for u in existing] + ["fake-user-1", "fake-user-2"]
+        payload = {
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [
+                {
+                    "op": "add",
+                    "value": {"members": [{"value": u} for u in usernames]},
+                }
+            ],
+        }
+        with mock.patch.object(signals.allocation_activate_user, "send") as send:
+            response = self.admin_client.patch(
+                f"/api/scim/v2/Groups/{allocation.id}", data=payload, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, len(usernames))
+
+        allocation_users = AllocationUser.objects.filter(allocation=allocation)
+        self.assertEqual(
+            sorted(au.pk for au in allocation_users),
+            sorted(c.kwargs["allocation_user_pk"] for c in send.call_args_list),
+        )
+        self.assertEqual(
+            sorted(au.user.username for au in allocation_users), sorted(usernames)
+        )
+        self.assertEqual(
+            ProjectUser.objects.filter(
+                project=project, user__username__in=usernames, status__name="Active"
+            ).count(),
+            len(usernames),
+        )
+        self.assertEqual(
+            sorted(m["value"] for m in response.json()["members"]), sorted(usernames)
+        )
+
+        payload["Operations"][0]["op"] = "remove"
+        with mock.patch.object(signals.allocation_remove_user, "send") as send:
+            response = self.admin_client.patch(
+                f"/api/scim/v2/Groups/{allocation.id}", data=payload, format="json"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(send.call_count, len(usernames))
+        self.assertEqual(response.json()["members"], [])
+
+    def test_add_group_members_upsert(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+        users = [self.new_user() for _ in range(3)]
+        manager = self.new_user()
+        self.new_project_user(manager, project, role="Manager")
+        self.new_allocation_user(allocation, users[0])
+
+        payload = {
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [
+                {
+                    "op": "add",
+                    "value": {
+                        "members": [{"value": u.username} for u in users + [manager]]
+                    },
+                }
+            ],
+        }
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.admin_client.patch(
+                    f"/api/scim/v2/Groups/{allocation.id}", data=payload, format="json"
+                )
+            self.assertEqual(response.status_code, 200)
+
+            # Memberships are written with one statement per table
+            for table in ("allocation_allocationuser", "project_projectuser"):
+                writes = [
+                    q["sql"]
+                    for q in ctx.captured_queries
+                    if q["sql"].startswith(
+                        (f'INSERT INTO "{table}"', f'UPDATE "{table}"')
+                    )
+                ]
+                self.assertEqual(len(writes), 1)
+
+        for u in users + [manager]:
+            au = AllocationUser.objects.get(allocation=allocation, user=u)
+            self.assertEqual(au.status.name, "Active")
+            pu = ProjectUser.objects.get(project=project, user=u)
+            self.assertEqual(pu.status.name, "Active")
+        # The role of existing project users is kept
+        self.assertEqual(
+            ProjectUser.objects.get(project=project, user=manager).role.name, "Manager"
+        )
+
+        history = AllocationUser.history.filter(
+            allocation=allocation, user=users[1]
+        ).order_by("history_date")
+        self.assertEqual([h.history_type for h in history], ["+", "~"])
+
+    def test_add_remove_group_members_choice_queries(self):
+        user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+        users = [self.new_user() for _ in range(3)]
+
+        def patch_group(operation, user):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.admin_client.patch(
+                    f"/api/scim/v2/Groups/{allocation.id}",
+                    data=get_payload_for_single_operation(operation, user.username),
+                    format="json",
+                )
+            self.assertEqual(response.status_code, 200)
+            return [
+                q["sql"]
+                for q in ctx.captured_queries
+                if any(
+                    f'FROM "{table}"' in q["sql"]
+                    for table in (
+                        "allocation_allocationuserstatuschoice",
+                        "project_projectuserstatuschoice",
+                        "project_projectuserrolechoice",
+                    )
+                )
+            ]
+
+        # The choices are loaded by the first membership change only
+        patch_group("add", users[0])
+        self.assertEqual(patch_group("add", users[1]), [])
+        self.assertEqual(patch_group("remove", users[0]), [])
+
+        # Changes to the choices are picked up
+        status = AllocationUserStatusChoice.objects.create(name="Test Status")
+        self.assertEqual(choices.get(AllocationUserStatusChoice, "Test Status"), status)
+        status.delete()
+        with self.assertRaises(AllocationUserStatusChoice.DoesNotExist):
+            choices.get(AllocationUserStatusChoice, "Test Status")
+
+        patch_group("add", users[2])
+        self.assertEqual(
+            AllocationUser.objects.get(
+                allocation=allocation, user=users[2]
+            ).status.name,
+            "Active",
+        )
+
     def test_normal_user_forbidden(self):
         response = self.logged_in_user_client.get("/api/scim/v2/Groups")
         self.assertEqual(response.status_code, 403)
@@ -153,3 +409,58 @@ class TestAllocation(base.TestBase):
         self.assertIn(project.title, group_list[0]["displayName"])
         self.assertEqual(len(group_list[0]["members"]), 1)
         self.assertEqual(group_list[0]["members"][0]["value"], user.email)
+
+    def test_filter_group_members_conditions(self):
+        user = self.new_user()
+        other_user = self.new_user()
+        project = self.new_project(pi=user)
+        allocation = self.new_allocation(project, self.resource, 1)
+        self.new_allocation_user(allocation, user)
+        self.new_allocation_user(allocation, other_user)
+
+        for op in ["or", "and"]:
+            response = self.admin_client.get(
+                f'/api/scim/v2/Groups?filter=members.value eq "{user.username}" '
+                f'{op} members.value eq "{other_user.username.upper()}"'
+            )
+            self.assertEqual(response.json()["totalResults"], 1)
+            self.assertEqual(response.json()["Resources"][0]["id"], allocation.id)
+
+        response = self.admin_client.get(
+            f'/api/scim/v2/Groups?filter=not (members.value eq "{user.username}")'
+            f' and members.value eq "{other_user.username}"'
+        )
+        self.assertEqual(response.json()["totalResults"], 0)
+
+    def test_filter_group_members_large(self):
+        # Seed many groups and members, and check that filtering by member
+        # stays fast. The time limit is generous to avoid flaky failures.
+        users = User.objects.bulk_create(
+            [User(username=f"member-{i}@example.com") for i in range(1000)]
+        )
+        status = AllocationUserStatusChoice.objects.get(name="Active")
+        allocation_users = []
+        for i in range(200):
+            project = self.new_project(pi=users[i])
+            allocation = self.new_allocation(project, self.resource, 1)
+            allocation_users.extend(
+                AllocationUser(allocation=allocation, user=user, status=status)
+                for user in users[i * 5 : i * 5 + 20]
+            )
+        AllocationUser.objects.bulk_create(allocation_users)
+
+        start = time.monotonic()
+        response = self.admin_client.get(
+            '/api/scim/v2/Groups?filter=members.value eq "member-500@example.com"'
+        )
+        self.assertLess(time.monotonic() - start, 5)
+
+        self.assertEqual(response.json()["totalResults"], 4)
+        self.assertEqual(
+            sorted(g["id"] for g in response.json()["Resources"]),
+            sorted(
+                AllocationUser.objects.filter(
+                    user__username="member-500@example.com"
+                ).values_list("allocation_id", flat=True)
+            ),
+        )
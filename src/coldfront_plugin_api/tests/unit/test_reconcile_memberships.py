@@ -0,0 +1,158 @@
+from io import StringIO
+import json
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import call_command
+from django.db.models import Max, Min
+
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationStatusChoice,
+    AllocationUser,
+    AllocationUserStatusChoice,
+)
+from coldfront.core.project.models import ProjectUserStatusChoice
+from coldfront_plugin_api.tests import base
+
+
+def reconcile(*args):
+    out = StringIO()
+    call_command("reconcile_memberships", *args, stdout=out)
+    return json.loads(out.getvalue())
+
+
+class TestReconcileMemberships(base.TestBase):
+    def reconcile(self, *args):
+        return reconcile(*args)
+
+    def test_reconcile(self):
+        report = self.reconcile()
+        self.assertEqual(sum(report["summary"].values()), 0)
+
+        allocation = Allocation.objects.first()
+        missing_user = self.new_user()
+        AllocationUser.objects.create(
+            user=missing_user,
+            allocation=allocation,
+            status=AllocationUserStatusChoice.objects.get(name="Active"),
+        )
+
+        removed_user = self.new_user()
+        pu = self.new_project_user(removed_user, allocation.project)
+        pu.status = ProjectUserStatusChoice.objects.get(name="Removed")
+        pu.save()
+        self.new_allocation_user(allocation, removed_user)
+
+        report = self.reconcile("--shard-size=1")
+        self.assertEqual(
+            report["summary"],
+            {
+                "missing_project_user": 1,
+                "active_user_of_inactive_allocation": 0,
+                "removed_project_user_in_allocation": 1,
+            },
+        )
+        self.assertIn(
+            {
+                "check": "missing_project_user",
+                "allocation": allocation.pk,
+                "allocation_status": allocation.status.name,
+                "project": allocation.project.pk,
+                "user": missing_user.username,
+            },
+            report["findings"],
+        )
+
+        allocation.status = AllocationStatusChoice.objects.get(name="Expired")
+        allocation.save()
+        report = self.reconcile()
+        self.assertEqual(
+            report["summary"]["active_user_of_inactive_allocation"],
+            AllocationUser.objects.filter(
+                allocation=allocation, status__name="Active"
+            ).count(),
+        )
+
+    def test_reconcile_resume(self):
+        allocation = Allocation.objects.first()
+        user = self.new_user()
+        AllocationUser.objects.create(
+            user=user,
+            allocation=allocation,
+            status=AllocationUserStatusChoice.objects.get(name="Active"),
+        )
+
+        with tempfile.TemporaryDirectory() as d:
+            checkpoint = os.path.join(d, "checkpoint.jsonl")
+            # The shard of the allocation was checked before the run was
+            # interrupted, and is not checked again. The shard being saved when
+            # it was interrupted is.
+            with open(checkpoint, "w") as f:
+                f.write(json.dumps({"shard_size": 1}) + "\n")
+                f.write(json.dumps({"start": allocation.pk, "findings": []}) + "\n")
+                f.write(json.dumps({"start": allocation.pk + 1})[:-1])
+
+            report = self.reconcile("--shard-size=1", f"--checkpoint={checkpoint}")
+            self.assertEqual(report["summary"]["missing_project_user"], 0)
+            self.assertFalse(os.path.exists(checkpoint))
+
+            output = os.path.join(d, "report.json")
+            call_command(
+                "reconcile_memberships",
+                "--shard-size=1",
+                f"--checkpoint={checkpoint}",
+                f"--output={output}",
+            )
+            with open(output) as f:
+                report = json.load(f)
+            self.assertEqual(report["summary"]["missing_project_user"], 1)
+
+
+class TestReconcileMembershipsWorkers(base.TransactionTestBase):
+    def test_reconcile_workers(self):
+        missing = []
+        for allocation in Allocation.objects.order_by("pk")[:3]:
+            user = self.new_user()
+            AllocationUser.objects.create(
+                user=user,
+                allocation=allocation,
+                status=AllocationUserStatusChoice.objects.get(name="Active"),
+            )
+            missing.append((allocation.pk, user.username))
+
+        with tempfile.TemporaryDirectory() as d:
+            checkpoint = os.path.join(d, "checkpoint.jsonl")
+            # Keep the checkpoint of the complete run
+            with mock.patch(
+                "coldfront_plugin_api.management.commands.reconcile_memberships.os.remove"
+            ):
+                report = reconcile(
+                    "--shard-size=1", "--workers=2", f"--checkpoint={checkpoint}"
+                )
+            with open(checkpoint) as f:
+                header, *shards = [json.loads(line) for line in f]
+
+        # The workers find the same inconsistencies as a sequential run
+        self.assertEqual(report, reconcile("--shard-size=1"))
+        self.assertEqual(
+            sorted(
+                (f["allocation"], f["user"])
+                for f in report["findings"]
+                if f["check"] == "missing_project_user"
+            ),
+            sorted(missing),
+        )
+
+        # Every shard was saved to the checkpoint
+        bounds = Allocation.objects.aggregate(first=Min("pk"), last=Max("pk"))
+        self.assertEqual(header, {"shard_size": 1})
+        self.assertEqual(
+            sorted(shard["start"] for shard in shards),
+            list(range(bounds["first"], bounds["last"] + 1)),
+        )
+        self.assertCountEqual(
+            [f for shard in shards for f in shard["findings"]],
+            report["findings"],
+        )
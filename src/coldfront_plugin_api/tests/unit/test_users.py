@@ -1,8 +1,11 @@
+import importlib.util
+import pathlib
 from unittest import mock
 import uuid
 
 from coldfront.core.resource import models as resource_models
 from coldfront.core.user.models import User
+from coldfront_plugin_api import utils
 from coldfront_plugin_api.tests import base
 from rest_framework.test import APIClient
 
@@ -77,6 +80,56 @@ class TestUsers(base.TestBase):
         self.assertEqual(user_dict["name"]["familyName"], "user 1")
         self.assertEqual(user_dict["emails"][0]["value"], "fake_user_1@example.com")
 
+    def test_get_user_not_modified(self):
+        user = self.new_user()
+        url = f"/api/scim/v2/Users/{user.username}"
+
+        response = self.admin_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        user.first_name = uuid.uuid4().hex
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        response = self.admin_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["name"]["givenName"], user.first_name)
+
+    def test_find_user_cached(self):
+        with mock.patch(
+            "coldfront.core.user.utils.CombinedUserSearch", wraps=fakes.FakeUserSearch
+        ) as search:
+            for _ in range(2):
+                found = utils.find_user("fake-user-1")
+                self.assertEqual(found["email"], "fake_user_1@example.com")
+                self.assertIsNone(utils.find_user("missing-user"))
+            self.assertEqual(search.call_count, 2)
+
+            # Saving the user invalidates its cached search result
+            self.new_user("fake-user-1")
+            utils.find_user("fake-user-1")
+            self.assertEqual(search.call_count, 3)
+
+        metrics = self.admin_client.get("/api/metrics").json()["user_search"]
+        self.assertEqual(metrics["hits"], 2)
+        self.assertEqual(metrics["misses"], 3)
+        self.assertEqual(metrics["provider_calls"], 3)
+
+    @mock.patch("coldfront.core.user.utils.CombinedUserSearch", fakes.FakeUserSearch)
+    def test_find_users(self):
+        found = utils.find_users(
+            ["fake-user-1", "fake-user-2", "missing-user", "fake-user-1"]
+        )
+        self.assertEqual(
+            sorted(found.keys()), ["fake-user-1", "fake-user-2", "missing-user"]
+        )
+        self.assertEqual(found["fake-user-1"], fakes.FAKE_USERS["fake-user-1"])
+        self.assertEqual(found["fake-user-2"], fakes.FAKE_USERS["fake-user-2"])
+        self.assertIsNone(found["missing-user"])
+
     def test_reseponse_404(self):
         fake_username = "9999"
         self.assertFalse(User.objects.filter(username=fake_username).exists())
@@ -116,3 +169,84 @@ class TestUsers(base.TestBase):
         self.assertEqual(len(user_list), 1)
         self.assertEqual(user_list[0]["userName"], username)
         self.assertEqual(user_list[0]["emails"][0]["value"], email)
+
+        # Filters on user attributes are case insensitive
+        for query in [
+            f'emails.value eq "{email.upper()}"',
+            f'name.familyName eq "{last_name.upper()}"',
+            f'userName sw "{username[:8].upper()}"',
+        ]:
+            r = self.admin_client.get(f"/api/scim/v2/Users?filter={query}")
+            self.assertEqual(r.json()["totalResults"], 1)
+            self.assertEqual(r.json()["Resources"][0]["userName"], username)
+
+    def test_user_query_escaped(self):
+        # Filters built by tools/register_users_from_csv.py
+        path = (
+            pathlib.Path(__file__).parents[4] / "tools" / "register_users_from_csv.py"
+        )
+        spec = importlib.util.spec_from_file_location("register_users_from_csv", path)
+        tool = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(tool)
+
+        prefix = uuid.uuid4().hex
+        usernames = [f'{prefix}"quoted', f"{prefix}\\back", f"{prefix}plain"]
+        for username in usernames:
+            self.new_user(username)
+        self.new_user(f"{prefix}quoted")
+
+        r = self.admin_client.get(
+            "/api/scim/v2/Users", {"filter": tool.user_filter(usernames)}
+        )
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(
+            sorted(u["userName"] for u in r.json()["Resources"]), sorted(usernames)
+        )
+
+        # Unescaped quotes are invalid
+        r = self.admin_client.get(
+            "/api/scim/v2/Users", {"filter": f'userName eq "{prefix}"quoted"'}
+        )
+        self.assertEqual(r.status_code, 400)
+
+    def test_list_users_pages(self):
+        prefix = uuid.uuid4().hex[:8]
+        for i in range(25):
+            User.objects.create(username=f"{prefix}-{i:02d}")
+        usernames = list(
+            User.objects.order_by("username").values_list("username", flat=True)
+        )
+
+        client = self.admin_client
+        for query in ["", f'&filter=userName sw "{prefix}"']:
+            expected = [u for u in usernames if query == "" or u.startswith(prefix)]
+            resources = []
+            start = 1
+            while start <= len(expected):
+                r = client.get(f"/api/scim/v2/Users?count=10&startIndex={start}{query}")
+                self.assertEqual(r.json()["totalResults"], len(expected))
+                resources += [u["userName"] for u in r.json()["Resources"]]
+                start += 10
+            self.assertEqual(resources, expected)
+
+        # Pages requested out of order are the same as pages requested in order
+        r = client.get(
+            f'/api/scim/v2/Users?count=5&startIndex=11&filter=userName sw "{prefix}"'
+        )
+        self.assertEqual(
+            [u["userName"] for u in r.json()["Resources"]],
+            [f"{prefix}-{i:02d}" for i in range(10, 15)],
+        )
+
+        # New users are counted and listed right away
+        User.objects.create(username=f"{prefix}-99")
+        r = client.get(
+            f'/api/scim/v2/Users?count=10&startIndex=21&filter=userName sw "{prefix}"'
+        )
+        self.assertEqual(r.json()["totalResults"], 26)
+        self.assertEqual(r.json()["Resources"][-1]["userName"], f"{prefix}-99")
+
+        with self.settings(PLUGIN_API_SCIM_MAX_PAGE_SIZE=3):
+            r = client.get("/api/scim/v2/Users?count=100")
+            self.assertEqual(r.json()["itemsPerPage"], 3)
+            self.assertEqual(len(r.json()["Resources"]), 3)
@@ -1,28 +1,53 @@
-from rest_framework import routers, viewsets
+import itertools
+
+from rest_framework import routers, views, viewsets
 from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.urlpatterns import format_suffix_patterns
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.urls import path
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q, QuerySet
 from django.core.exceptions import FieldError
-from coldfront.core.allocation.models import Allocation
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import dateparse, timezone
+from coldfront.core.allocation.models import (
+    Allocation,
+    AllocationAttribute,
+    AllocationUser,
+)
 from django_scim import views as scim_views
 
-from coldfront_plugin_api import auth, serializers
+from coldfront_plugin_api import (
+    allocation_cache,
+    auth,
+    conditional,
+    filters,
+    metrics,
+    pagination,
+    renderers,
+    serializers,
+)
+from coldfront_plugin_api.scim_v2 import views as coldfront_scim_views
 
 
 class AllocationViewSet(viewsets.ReadOnlyModelViewSet):
     """
     This viewset implements the API to Coldfront's allocation object
-    The API allows filtering allocations by any of Coldfront's allocation model attributes,
+    The API allows filtering allocations by a set of Coldfront's allocation model fields,
     as well as by Allocation Attributes.
 
-    Filtering by allocation model attributes
-    (i.e by pk, start_date, or even by attributes that span relationships, like project PI email)
-    is possible by using the query parameters directly as Django query filters.
+    Filtering by allocation model fields (i.e by pk, start_date, or even by fields that span
+    relationships, like project PI email) is possible by using the query parameters as
+    Django query filters. Only the fields and lookups listed in
+    `coldfront_plugin_api.filters.FIELD_FILTERS` are allowed, as each of them is backed
+    by a database index.
 
     For example, to filter by the allocation's project PI email: "/api/allocations?project__pi__email=test@bu.edu"
+    Or, to filter by allocations ending before a date: "/api/allocations?end_date__lt=2024-01-01"
 
-    Filtering using this method requires knowledge of the Allocation model schema and Django's filters
     Documentation of Coldfront Allocation model: https://coldfront.readthedocs.io/en/latest/apidocs/allocations/
     Documentation for Django's query syntax: https://docs.djangoproject.com/en/5.0/topics/db/queries/#lookups-that-span-relationships
 
@@ -38,12 +63,52 @@ class AllocationViewSet(viewsets.ReadOnlyModelViewSet):
     I.e, to filter for allocations with AA Quota Limits CPU equal 2 AND Quota RAM equals 4G:
     "/api/allocations?attr_quota limits cpu=2&attr_quota ram=4G"
 
-    In cases where an invalid model attribute or AA is queried, an empty list is returned
+    In cases where an invalid or unsupported model field, lookup, or AA is queried, an
+    empty list is returned
+
+    Results are paginated by allocation id when the "page_size" or "cursor" query
+    parameter is present, i.e "/api/allocations?page_size=500". The response then
+    contains a "next" link with the cursor for the following page. Without either
+    parameter, all matching allocations are returned in a single list.
+
+    For large exports, the list can be streamed as newline delimited JSON, with one
+    allocation per line, by adding "format=ndjson" to the query parameters or by
+    sending the "Accept: application/x-ndjson" header. Streamed responses are
+    never paginated.
+
+    Responses carry an ETag header. Requests with a matching "If-None-Match" header
+    are answered with 304 Not Modified.
+
+    To only return some fields of the allocations, list them in "fields", i.e
+    "/api/allocations?fields=id,status,attributes". The attributes returned can be
+    limited the same way with "attributes", by name (case insensitive), i.e
+    "/api/allocations?attributes=Quota Limits CPU,Quota Limits RAM". Relations
+    that aren't returned are not queried, for the response nor for its validators.
+
+    To synchronize incrementally, pass the time of the previous poll as an ISO 8601
+    timestamp in "modified_since", i.e "/api/allocations?all=true&modified_since=2024-05-01T12:00:00Z".
+    Only allocations whose allocation, attributes, users or project were modified at
+    or after that time are returned. Deleted attributes are not detected.
     """
 
     serializer_class = serializers.AllocationSerializer
     authentication_classes = auth.AUTHENTICATION_CLASSES
     permission_classes = [IsAdminUser]
+    pagination_class = pagination.AllocationCursorPagination
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
+        renderers.NDJSONRenderer
+    ]
+
+    # Query parameters that control the response rather than filter allocations
+    reserved_query_params = {
+        "all",
+        "cursor",
+        "page_size",
+        "format",
+        "modified_since",
+        "fields",
+        "attributes",
+    }
 
     def get_queryset(self):
         queryset = Allocation.objects.filter(status__name="Active")
@@ -52,39 +117,232 @@ class AllocationViewSet(viewsets.ReadOnlyModelViewSet):
         if query_params.get("all") == "true":
             queryset = Allocation.objects.all()
 
+        if modified_since := query_params.get("modified_since"):
+            queryset = queryset.filter(
+                self._modified_since_filter(self._parse_timestamp(modified_since))
+            )
+
         allocation_attr_prefix = "attr_"
 
         for query, val in query_params.items():
-            if query == "all":
+            if query in self.reserved_query_params:
                 continue
             if query.startswith(allocation_attr_prefix):
-                attribute_query = query[len(allocation_attr_prefix) :]
-                val_list = query_params.getlist(query)
-
-                # Using Django's Q object to create OR query for attribute
-                # https://docs.djangoproject.com/en/5.0/topics/db/queries/#complex-lookups-with-q-objects
-                q_query = Q()
-                for val in val_list:
-                    q_query = q_query | Q(allocationattribute__value=val)
-
-                queryset = queryset.filter(
-                    q_query,
-                    allocationattribute__allocation_attribute_type__name__iexact=attribute_query,
+                attribute_filter = filters.attribute_filter(
+                    query[len(allocation_attr_prefix) :], query_params.getlist(query)
                 )
+                if attribute_filter is None:
+                    queryset = queryset.none()
+                else:
+                    queryset = queryset.filter(attribute_filter)
 
             else:
-                val_list = query_params.getlist(query)
-                q_query = Q()
-                for val in val_list:
-                    q_query = q_query | Q(**{query: val})
+                q_query = filters.field_filter(query, query_params.getlist(query))
+                if q_query is None:
+                    queryset = queryset.none()
+                    continue
 
                 try:
                     queryset = queryset.filter(q_query)
-                except FieldError:
+                except (FieldError, ValueError, DjangoValidationError):
+                    # Values that can't be converted to the field's type
                     queryset = queryset.none()
 
         return queryset
 
+    def get_fieldset(self):
+        """
+        Returns the fields and the ids of the attribute types requested with the
+        "fields" and "attributes" query parameters, each None if not given.
+        """
+        query_params = self.request.query_params
+
+        def get_list(param):
+            return [
+                item.strip()
+                for value in query_params.getlist(param)
+                for item in value.split(",")
+                if item.strip()
+            ]
+
+        fields = None
+        if "fields" in query_params:
+            fields = get_list("fields")
+            if invalid := set(fields) - set(self.serializer_class.Meta.fields):
+                raise ValidationError(
+                    {"fields": f"Invalid fields {', '.join(sorted(invalid))}."}
+                )
+
+        attribute_type_ids = None
+        if "attributes" in query_params:
+            attribute_type_ids = [
+                pk
+                for name in get_list("attributes")
+                for pk in filters.get_attribute_type_ids(name)
+            ]
+        return fields, attribute_type_ids
+
+    @staticmethod
+    def _parse_timestamp(value):
+        try:
+            timestamp = dateparse.parse_datetime(value)
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            raise ValidationError(
+                {"modified_since": f"Invalid ISO 8601 timestamp '{value}'."}
+            )
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        return timestamp
+
+    @staticmethod
+    def _modified_since_filter(timestamp):
+        """
+        Matches allocations where the allocation, its project, or any of its
+        attributes or users have been modified since the timestamp.
+        """
+        return (
+            Q(modified__gte=timestamp)
+            | Q(project__modified__gte=timestamp)
+            | Exists(
+                AllocationAttribute.objects.filter(
+                    allocation=OuterRef("pk"), modified__gte=timestamp
+                )
+            )
+            | Exists(
+                AllocationUser.objects.filter(
+                    allocation=OuterRef("pk"), modified__gte=timestamp
+                )
+            )
+        )
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        fieldset = self.get_fieldset()
+        validators = conditional.allocation_validators(
+            request, queryset, fieldset=fieldset
+        )
+        if response := conditional.get_not_modified_response(request, validators):
+            return response
+
+        if isinstance(request.accepted_renderer, renderers.NDJSONRenderer):
+            response = StreamingHttpResponse(
+                self.stream_ndjson(queryset, request.accepted_renderer, fieldset),
+                content_type=request.accepted_renderer.media_type,
+            )
+        elif (page := self.paginate_queryset(queryset)) is not None:
+            data = self.serialize_allocations(
+                [allocation.pk for allocation in page], fieldset
+            )
+            response = self.get_paginated_response(data)
+        else:
+            response = Response(self.serialize_allocations(queryset, fieldset))
+        return conditional.set_validator_headers(response, validators)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        fieldset = self.get_fieldset()
+        validators = conditional.allocation_validators(
+            request,
+            Allocation.objects.filter(pk=instance.pk),
+            fieldset=fieldset,
+        )
+        if response := conditional.get_not_modified_response(request, validators):
+            return response
+
+        data = self.serialize_allocations([instance.pk], fieldset)[0]
+        return conditional.set_validator_headers(Response(data), validators)
+
+    def serialize_allocations(self, allocations, fieldset=(None, None)) -> list:
+        """
+        Returns the serialized allocations, in the same order as `allocations`,
+        which is either a list of ids or a queryset. Cached payloads are reused,
+        and the other allocations are serialized together with a single eager
+        loading plan.
+
+        Allocations serialized with only some of their fields or attributes, as
+        returned by `get_fieldset`, are not cached.
+
+        Querysets that aren't cached are serialized with a single query plan
+        filtering on the queryset itself, and otherwise by chunks of ids, so that
+        lists of ids of unbounded length are never sent to the database.
+        """
+        fields, attribute_type_ids = fieldset
+        cached = fields is None and attribute_type_ids is None
+
+        def serialize(queryset) -> list:
+            allocations = list(
+                self.serializer_class.setup_eager_loading(
+                    queryset, fields, attribute_type_ids
+                )
+            )
+            if fields is None or "attributes" in fields:
+                self.serializer_class.load_attributes(
+                    allocations, attribute_type_ids, queryset
+                )
+            serializer = self.get_serializer(allocations, many=True, fields=fields)
+            # The id may not be one of the fields
+            return [
+                (allocation.pk, data)
+                for allocation, data in zip(allocations, serializer.data)
+            ]
+
+        def serialize_ids(allocation_ids) -> dict:
+            return dict(serialize(Allocation.objects.filter(pk__in=allocation_ids)))
+
+        if isinstance(allocations, QuerySet):
+            if not cached or not allocation_cache.is_enabled():
+                return [data for _, data in serialize(allocations)]
+            return [
+                data
+                for chunk in self.chunk_ids(allocations)
+                for data in allocation_cache.get_or_serialize(chunk, serialize_ids)
+            ]
+
+        if cached:
+            return allocation_cache.get_or_serialize(list(allocations), serialize_ids)
+
+        allocation_ids = list(allocations)
+        serialized = serialize_ids(allocation_ids)
+        return [serialized[pk] for pk in allocation_ids if pk in serialized]
+
+    @staticmethod
+    def chunk_ids(queryset):
+        """
+        Yields the ids of the allocations of the queryset, by lists of at most
+        PLUGIN_API_ALLOCATION_STREAM_CHUNK_SIZE ids.
+        """
+        chunk_size = settings.PLUGIN_API_ALLOCATION_STREAM_CHUNK_SIZE
+        allocation_ids = queryset.values_list("pk", flat=True).iterator(
+            chunk_size=chunk_size
+        )
+        while chunk := list(itertools.islice(allocation_ids, chunk_size)):
+            yield chunk
+
+    def stream_ndjson(self, queryset, renderer, fieldset=(None, None)):
+        """
+        Serializes the allocations one chunk at a time, so that memory usage
+        stays flat and the first line is sent before the whole queryset has been
+        read from the database.
+        """
+        for chunk in self.chunk_ids(queryset):
+            for data in self.serialize_allocations(chunk, fieldset):
+                yield renderer.render_line(data)
+
+
+class MetricsView(views.APIView):
+    """
+    Returns the plugin's monitoring counters, such as the hit rate of the
+    serialized allocation cache.
+    """
+
+    authentication_classes = auth.AUTHENTICATION_CLASSES
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
+
 
 app_name = "scim"
 
@@ -94,10 +352,33 @@ router.register(r"allocations", AllocationViewSet, basename="api-allocation")
 urlpatterns = router.urls
 
 urlpatterns += [
-    path("scim/v2/Groups", scim_views.GroupsView.as_view(), name="groups"),
-    path("scim/v2/Groups/<int:uuid>", scim_views.GroupsView.as_view(), name="groups"),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path(
+        "scim/v2/Groups",
+        coldfront_scim_views.ColdfrontGroupsView.as_view(),
+        name="groups",
+    ),
+    path(
+        "scim/v2/Groups/<int:uuid>",
+        coldfront_scim_views.ColdfrontGroupsView.as_view(),
+        name="groups",
+    ),
     path("scim/v2", scim_views.SCIMView.as_view(implemented=False), name="root"),
-    path("scim/v2/Users", scim_views.UsersView.as_view(), name="users"),
-    path("scim/v2/Users/<str:uuid>", scim_views.UsersView.as_view(), name="users"),
+    path("scim/v2/Bulk", coldfront_scim_views.BulkView.as_view(), name="bulk"),
+    path(
+        "scim/v2/ServiceProviderConfig",
+        scim_views.ServiceProviderConfigView.as_view(),
+        name="service-provider-config",
+    ),
+    path(
+        "scim/v2/Users",
+        coldfront_scim_views.ColdfrontUsersView.as_view(),
+        name="users",
+    ),
+    path(
+        "scim/v2/Users/<str:uuid>",
+        coldfront_scim_views.ColdfrontUsersView.as_view(),
+        name="users",
+    ),
 ]
 urlpatterns = format_suffix_patterns(urlpatterns)
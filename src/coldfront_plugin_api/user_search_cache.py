@@ -0,0 +1,114 @@
+"""
+Cache of user lookups in the configured search providers.
+
+Results are kept in a bounded, per process LRU cache, and optionally in the
+Django cache backend so that they are shared between worker processes. Users
+that weren't found are cached too, for a shorter time, so that repeated
+lookups of unknown usernames don't reach the identity provider either. The
+receivers in `receivers.py` invalidate a username when its user is saved.
+"""
+
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = "coldfront_plugin_api:user_search"
+
+# Returned by `get` for usernames that aren't cached, as None is cached for
+# users that weren't found
+MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe LRU cache whose entries expire after their timeout."""
+
+    def __init__(self):
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return MISSING
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, max_size):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = LRUCache()
+
+
+def _key(username):
+    return f"{KEY_PREFIX}:{username}"
+
+
+def get(username):
+    """
+    Returns the cached search result for the username, which is None for
+    users that weren't found, or MISSING if there is none.
+    """
+    found = _local.get(username)
+    if found is MISSING and settings.PLUGIN_API_USER_SEARCH_SHARED_CACHE:
+        found = cache.get(_key(username), MISSING)
+        if found is not MISSING:
+            _local.set(
+                username,
+                found,
+                _get_timeout(found),
+                settings.PLUGIN_API_USER_SEARCH_CACHE_SIZE,
+            )
+
+    # Callers get their own copy of the cached entry
+    return dict(found) if isinstance(found, dict) else found
+
+
+def set(username, found):
+    timeout = _get_timeout(found)
+    if timeout <= 0:
+        return
+
+    _local.set(username, found, timeout, settings.PLUGIN_API_USER_SEARCH_CACHE_SIZE)
+    if settings.PLUGIN_API_USER_SEARCH_SHARED_CACHE:
+        cache.set(_key(username), found, timeout=timeout)
+
+
+def invalidate(usernames):
+    for username in usernames:
+        _local.delete(username)
+    if settings.PLUGIN_API_USER_SEARCH_SHARED_CACHE:
+        cache.delete_many([_key(username) for username in usernames])
+
+
+def clear():
+    """Clears the cache of this process. Shared entries are left to expire."""
+    _local.clear()
+
+
+def _get_timeout(found):
+    if found is None:
+        return settings.PLUGIN_API_USER_SEARCH_NEGATIVE_CACHE_TIMEOUT
+    return settings.PLUGIN_API_USER_SEARCH_CACHE_TIMEOUT
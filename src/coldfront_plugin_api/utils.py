@@ -1,12 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
 from coldfront.core.user import utils as user_utils
+from django import db
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 
+from coldfront_plugin_api import metrics, user_search_cache
+
 
 def find_user(username):
-    """Searches for a user in the configured search providers."""
+    """
+    Searches for a user in the configured search providers.
+
+    Results, including users that weren't found, are cached. See
+    `coldfront_plugin_api.user_search_cache`.
+    """
+    found = _get_cached_user(username)
+    if found is user_search_cache.MISSING:
+        found = _search_and_cache_user(username)
+    return found
+
+
+def find_users(usernames) -> dict:
+    """
+    Searches for multiple users in the configured search providers.
+
+    Usernames that aren't cached are searched for concurrently, by up to
+    PLUGIN_API_USER_SEARCH_WORKERS threads. Returns a dict of username to
+    the search result, which is None for users that weren't found.
+    """
+    found = {username: _get_cached_user(username) for username in usernames}
+    missing = [u for u, entry in found.items() if entry is user_search_cache.MISSING]
+
+    if len(missing) == 1:
+        found[missing[0]] = _search_and_cache_user(missing[0])
+    elif missing:
+        workers = min(len(missing), settings.PLUGIN_API_USER_SEARCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            found.update(zip(missing, executor.map(_search_user_in_thread, missing)))
+
+    return found
+
+
+def _get_cached_user(username):
+    found = user_search_cache.get(username)
+    if found is not user_search_cache.MISSING:
+        metrics.incr("user_search.hits")
+    return found
+
+
+def _search_and_cache_user(username):
+    metrics.incr("user_search.misses")
+    found = _search_user(username)
+    user_search_cache.set(username, found)
+    return found
+
+
+def _search_user_in_thread(username):
+    try:
+        return _search_and_cache_user(username)
+    finally:
+        # Search providers may query the database from the worker thread,
+        # which opens a connection that would otherwise never be closed.
+        db.connections.close_all()
+
+
+def _search_user(username):
+    start = time.monotonic()
     search = user_utils.CombinedUserSearch(username, "username_only")
     results = search.search().get("matches")
+    metrics.incr("user_search.provider_calls")
+    metrics.incr("user_search.provider_ms", round((time.monotonic() - start) * 1000))
 
     found = None
     if results:
@@ -54,6 +120,34 @@ def get_or_fetch_user(username):
     return user
 
 
+def get_or_fetch_users(usernames):
+    """
+    Bulk version of get_or_fetch_user.
+
+    Resolves all the usernames with a single query, and looks up the missing
+    ones from the configured search providers with find_users. Returns the users
+    in the order of the (deduplicated) usernames, or raises
+    User.DoesNotExist if any of them can't be found.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    users = {u.username: u for u in User.objects.filter(username__in=usernames)}
+
+    found = find_users(u for u in usernames if u not in users)
+    for username, entry in found.items():
+        if not entry:
+            raise User.DoesNotExist(f"User {username} not found.")
+
+    for username, entry in found.items():
+        users[username] = create_user(
+            username=username,
+            first_name=entry.get("first_name", ""),
+            last_name=entry.get("last_name", ""),
+            email=entry.get("email", ""),
+        )
+
+    return [users[username] for username in usernames]
+
+
 def is_user_superuser(user: User):
     """
     As a temporary hack, this function will handle raising the appropriate 403 error if
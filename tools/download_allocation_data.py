@@ -2,27 +2,82 @@
 Download ColdFront allocation data.
 
 Usage:
-    python3 download_allocation_data.py <coldfront_allocation_api_url> <output_file>
+    python3 download_allocation_data.py [OPTIONS] <coldfront_allocation_api_url> <output_file>
+
+Allocations are downloaded in shards of consecutive ids, fetched in parallel as
+newline delimited JSON and streamed to disk, so the full list is never held in
+memory. Failed requests are retried with exponential backoff.
+
+The output is a JSON list of allocations, or newline delimited JSON with
+--format ndjson (the default for .ndjson and .jsonl files). Files ending in .gz
+are compressed with gzip.
+
+With --since, only the allocations modified since the given ISO 8601 timestamp
+are downloaded and merged into the existing output file. --since without a
+value uses the time of the previous download into the same file.
 
 - Environment variables CLIENT_ID and CLIENT_SECRET must be set,
 corresponding to a service account in Keycloak.
 """
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import gzip
 import json
 import logging
 import os
-import sys
+import tempfile
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
+import click
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger()
 
+# Statuses of responses that are retried with backoff
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Size of the chunks of the responses written to disk
+CHUNK_SIZE = 64 * 1024
+
+# How far back from the start of a download the next --since starts, so that
+# allocations modified during the download, or clock skew with the server,
+# are never missed. Merging an allocation twice is harmless.
+SINCE_OVERLAP = datetime.timedelta(minutes=5)
+
 
 class ColdFrontClient(object):
-    def __init__(self, keycloak_url, keycloak_client_id, keycloak_client_secret):
+    def __init__(
+        self,
+        keycloak_url,
+        keycloak_client_id,
+        keycloak_client_secret,
+        workers=4,
+        retries=5,
+    ):
         self.session = self.get_session(
             keycloak_url, keycloak_client_id, keycloak_client_secret
         )
+        self.retries = retries
+
+        # Connections are pooled for every worker, and failed requests are
+        # retried with exponential backoff.
+        adapter = HTTPAdapter(
+            pool_maxsize=workers,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=1,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=["GET"],
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     @staticmethod
     def get_session(keycloak_url, keycloak_client_id, keycloak_client_secret):
@@ -44,17 +99,234 @@ class ColdFrontClient(object):
         session.headers.update(headers)
         return session
 
+    def has_allocations(self, url, **params):
+        r = self.session.get(with_params(url, page_size=1, format="json", **params))
+        r.raise_for_status()
+        return bool(r.json()["results"])
+
+    def find_id_bound(self, url, shard_size):
+        """
+        Returns an id greater than the ids of all the allocations, and less than
+        shard_size above the largest of them.
+        """
+        low, high = 0, shard_size
+        while self.has_allocations(url, id__gte=high):
+            low, high = high, high * 2
+        while high - low > shard_size:
+            middle = (low + high) // 2
+            if self.has_allocations(url, id__gte=middle):
+                low = middle
+            else:
+                high = middle
+        return high
+
+    def download_shard(self, url, start, end, path):
+        """
+        Streams the allocations with start <= id < end to a newline delimited
+        JSON file. Transfers interrupted midway are restarted with backoff.
+        """
+        shard_url = with_params(url, id__gte=start, id__lt=end, format="ndjson")
+        for attempt in range(self.retries + 1):
+            try:
+                with self.session.get(shard_url, stream=True) as r:
+                    r.raise_for_status()
+                    with open(path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+                return
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(
+                    f"Error downloading allocations {start} to {end - 1}, "
+                    f"retrying in {2**attempt}s: {e}"
+                )
+                time.sleep(2**attempt)
+
+
+def with_params(url, **params):
+    """Returns the url with the query parameters added, or replaced."""
+    parts = urlsplit(url)
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k not in params
+    ]
+    query += [(k, str(v)) for k, v in params.items()]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def open_file(path, mode):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def read_shards(paths):
+    """Yields the allocations of the downloaded shards, as JSON strings."""
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line := line.strip():
+                    yield line
+
+
+def read_snapshot(path):
+    """Yields the allocations of a file written by this tool, as JSON strings."""
+    with open_file(path, "rt") as f:
+        for line in f:
+            line = line.strip().rstrip(",")
+            if line.startswith("[") and line != "[":
+                # A whole list on a single line, from an older version of this tool
+                yield from (json.dumps(a) for a in json.loads(line))
+            elif line not in ("", "[", "]"):
+                yield line
+
+
+def merge_allocations(snapshot, updates, only_active):
+    """
+    Replaces the allocations of the snapshot with their updated version, and
+    adds the new ones. When only_active is set, updated allocations that are
+    no longer active are removed instead.
+    """
+    updates = {json.loads(line)["id"]: line for line in updates}
+
+    def keep(line):
+        return not only_active or json.loads(line)["status"] == "Active"
+
+    for line in snapshot:
+        allocation_id = json.loads(line)["id"]
+        line = updates.pop(allocation_id, line)
+        if keep(line):
+            yield line
+    for line in updates.values():
+        if keep(line):
+            yield line
+
+
+def write_allocations(path, allocations, output_format):
+    count = 0
+    with open_file(path, "wt") as f:
+        if output_format == "json":
+            f.write("[\n")
+        for line in allocations:
+            if output_format == "json" and count:
+                f.write(",\n")
+            f.write(line)
+            if output_format == "ndjson":
+                f.write("\n")
+            count += 1
+        if output_format == "json":
+            f.write("\n]\n")
+    return count
+
+
+@click.command(help="Download ColdFront allocation data.")
+@click.argument("url")
+@click.argument("output_file", type=click.Path(dir_okay=False))
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=4,
+    help="Number of shards downloaded in parallel. Defaults to 4.",
+)
+@click.option(
+    "--shard-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    help="Number of allocation ids downloaded per request. Defaults to 1000.",
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(["json", "ndjson"]),
+    help="Format of the output file. Defaults to ndjson for .ndjson and .jsonl files, json otherwise.",
+)
+@click.option(
+    "--since",
+    is_flag=False,
+    flag_value="last",
+    help=(
+        "Only download the allocations modified since this ISO 8601 timestamp, "
+        "and merge them into the output file. Without a value, uses the time "
+        "of the previous download."
+    ),
+)
+@click.option(
+    "--retries",
+    type=click.IntRange(min=0),
+    default=5,
+    help="Number of times a failed request is retried. Defaults to 5.",
+)
+def main(url, output_file, workers, shard_size, output_format, since, retries):
+    if output_format is None:
+        name = (
+            output_file[: -len(".gz")] if output_file.endswith(".gz") else output_file
+        )
+        output_format = "ndjson" if name.endswith((".ndjson", ".jsonl")) else "json"
+
+    since_file = f"{output_file}.since"
+    if since and not os.path.exists(output_file):
+        raise click.UsageError(f"--since requires an existing {output_file}")
+    if since == "last":
+        if not os.path.exists(since_file):
+            raise click.UsageError(f"No previous download time in {since_file}")
+        with open(since_file) as f:
+            since = f.read().strip()
+
+    started = datetime.datetime.now(datetime.timezone.utc)
 
-def main():
     client = ColdFrontClient(
         "https://keycloak.mss.mghpcc.org",
         os.environ.get("CLIENT_ID"),
         os.environ.get("CLIENT_SECRET"),
+        workers=workers,
+        retries=retries,
     )
-    r = client.session.get(sys.argv[1])
 
-    with open(sys.argv[2], "w") as output:
-        json.dump(r.json(), output)
+    only_active = False
+    if since:
+        url = with_params(url, modified_since=since)
+        if dict(parse_qsl(urlsplit(url).query)).get("all") != "true":
+            # Also download the allocations that are no longer active, to
+            # remove them from the snapshot.
+            url = with_params(url, all="true")
+            only_active = True
+
+    id_bound = client.find_id_bound(url, shard_size)
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    with tempfile.TemporaryDirectory(dir=output_dir) as tmp:
+        shards = [
+            (start, os.path.join(tmp, f"shard-{start}.ndjson"))
+            for start in range(0, id_bound, shard_size)
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    client.download_shard, url, start, start + shard_size, path
+                )
+                for start, path in shards
+            ]
+            for future in futures:
+                future.result()
+
+        allocations = read_shards(path for _, path in shards)
+        if since:
+            allocations = merge_allocations(
+                read_snapshot(output_file), allocations, only_active
+            )
+
+        # Replace the output file only once it is complete
+        tmp_output = os.path.join(tmp, os.path.basename(output_file))
+        count = write_allocations(tmp_output, allocations, output_format)
+        os.replace(tmp_output, output_file)
+
+    with open(since_file, "w") as f:
+        f.write((started - SINCE_OVERLAP).isoformat())
+    logger.info(f"Wrote {count} allocations to {output_file}")
 
 
 if __name__ == "__main__":
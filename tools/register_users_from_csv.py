@@ -16,19 +16,27 @@ Options:
   --auth-type                     Method of authentication to Keycloak. Pick either 'secret'
                                   to use client sercet, 'oauth2' to use the device
                                   authorization grant flow, or 'workaround'.
+  --concurrency INTEGER           Number of requests to ColdFront made in
+                                  parallel. Defaults to 4.
+  --rate FLOAT                    Maximum number of requests to ColdFront per
+                                  second. Defaults to 10.
   --help                          Show this message and exit.
 
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import csv
+import json
 import logging
 import os
 import re
 import sys
+import threading
 import time
 
 import click
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 logging.basicConfig(level=logging.INFO)
@@ -40,6 +48,40 @@ KEYCLOAK_USERNAME = os.getenv("KEYCLOAK_USERNAME")
 KEYCLOAK_PASSWORD = os.getenv("KEYCLOAK_PASSWORD")
 IMPERSONATE_USER = ""
 
+# Refresh the access token when it expires in less than this many seconds
+TOKEN_EXPIRY_MARGIN = 30
+
+# Number of users looked up with a single SCIM filter query
+USER_LOOKUP_BATCH_SIZE = 50
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing `rate` requests per second on average, in bursts of
+    up to `burst` requests. Safe to share between threads.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 
 class KeycloakClient(object):
     def __init__(self):
@@ -100,16 +142,38 @@ class KeycloakClient(object):
 
 
 class ScimClient(object):
-    def __init__(self, scim_url, keycloak_url, auth_type):
+    """
+    Client for the SCIM API of ColdFront, safe to share between threads.
+
+    Requests reuse the connections of a single session, are rate limited,
+    and the access token is only refreshed when it is about to expire.
+    """
+
+    def __init__(self, scim_url, keycloak_url, auth_type, concurrency=4, rate=10):
         self.scim_url = scim_url
         self.keycloak_url = keycloak_url
         self.auth_type = auth_type
-        self.session = self.refresh_session()
+        self.rate_limiter = RateLimiter(rate)
+
+        self.session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        self.token_lock = threading.Lock()
+        self.token_expires_at = None
+        self.refresh_token = None
+        self.refresh_session()
+
+    @property
+    def token_url(self):
+        return f"{self.keycloak_url}/auth/realms/mss/protocol/openid-connect/token"
 
     def refresh_session(self):
         """Authenticate as a client with Keycloak to receive an access token."""
         keycloak_client_id = os.environ.get("CLIENT_ID")
-        token_url = f"{self.keycloak_url}/auth/realms/mss/protocol/openid-connect/token"
+        token_url = self.token_url
 
         if self.auth_type == "secret":
             keycloak_client_secret = os.environ.get("CLIENT_SECRET")
@@ -119,7 +183,25 @@ class ScimClient(object):
                 auth=HTTPBasicAuth(keycloak_client_id, keycloak_client_secret),
             )
         elif self.auth_type == "workaround":
-            return KeycloakClient().get_session_for_user(IMPERSONATE_USER)
+            # The session is authenticated with the cookies of the impersonated
+            # user, which have no known expiration time.
+            user_session = KeycloakClient().get_session_for_user(IMPERSONATE_USER)
+            self.session.cookies.update(user_session.cookies)
+            logger.info("Authenticated with Keycloak")
+            return
+        elif self.auth_type == "oauth2" and self.refresh_token:
+            r = requests.post(
+                token_url,
+                data={
+                    "grant_type": "refresh_token",
+                    "client_id": keycloak_client_id,
+                    "refresh_token": self.refresh_token,
+                },
+            )
+            if "access_token" not in r.json():
+                # The refresh token expired, start over with the device flow
+                self.refresh_token = None
+                return self.refresh_session()
         elif self.auth_type == "oauth2":
             device_url = f"{self.keycloak_url}/auth/realms/mss/protocol/openid-connect/auth/device"
 
@@ -141,9 +223,6 @@ class ScimClient(object):
             print("Please login at ", verification_url)
             print("Waiting for device authentication...")
 
-            token_url = (
-                f"{self.keycloak_url}/auth/realms/mss/protocol/openid-connect/token"
-            )
             data = {
                 "client_id": keycloak_client_id,
                 "grant_type": "urn:ietf:params:oauth:grant-type:device_code",
@@ -161,67 +240,113 @@ class ScimClient(object):
         else:
             sys.exit("Invalid authorization method. Please choose 'secret' or 'oauth2'")
 
-        access_token = r.json()["access_token"]
-
-        session = requests.session()
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json",
-        }
-        session.headers.update(headers)
+        token = r.json()
+        self.session.headers.update(
+            {"Authorization": f"Bearer {token['access_token']}"}
+        )
+        self.refresh_token = token.get("refresh_token")
+        if "expires_in" in token:
+            self.token_expires_at = time.monotonic() + float(token["expires_in"])
 
         logger.info("Authenticated with Keycloak")
-        return session
+
+    def ensure_token(self):
+        """Refreshes the access token if it is about to expire."""
+        if self.token_expires_at is None:
+            return
+        with self.token_lock:
+            if time.monotonic() > self.token_expires_at - TOKEN_EXPIRY_MARGIN:
+                self.refresh_session()
+
+    def request(self, method, path, **kwargs):
+        self.ensure_token()
+        self.rate_limiter.acquire()
+        r = self.session.request(method, f"{self.scim_url}/{path}", **kwargs)
+        if r.status_code == 401:
+            # The token was revoked or expired early
+            with self.token_lock:
+                self.refresh_session()
+            self.rate_limiter.acquire()
+            r = self.session.request(method, f"{self.scim_url}/{path}", **kwargs)
+        return r
+
+    def find_existing_users(self, usernames):
+        """Returns which of the usernames already exist, with one query per batch."""
+        existing = set()
+        for i in range(0, len(usernames), USER_LOOKUP_BATCH_SIZE):
+            batch = usernames[i : i + USER_LOOKUP_BATCH_SIZE]
+            r = self.request(
+                "GET",
+                "Users",
+                params={"filter": user_filter(batch), "count": len(batch)},
+            )
+            r.raise_for_status()
+            existing.update(u["userName"] for u in r.json()["Resources"])
+        return existing
 
     def create_user(self, username, first_name, last_name, email):
         """Create a user."""
-        url = f"{self.scim_url}/Users/{username}"
-        r = self.session.get(url)
-        if r.status_code == 200:
-            print(f"User {username} exists.")
-        if r.status_code in [404, 500]:
-            print(f"Creating user {username}.")
-            payload = {
-                "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
-                "userName": username,
-                "name": {
-                    "givenName": first_name,
-                    "familyName": last_name,
-                },
-                "emails": [
-                    {
-                        "value": email,
-                        "type": "work",
-                        "primary": True,
-                    }
-                ],
-            }
-            r = self.session.post(f"{self.scim_url}/Users", json=payload)
-            if r.status_code == 201:
-                print(f"Created user {username}.")
-            else:
-                logger.error(
-                    f"Error creating user {username}: {r.status_code}: {r.text}"
-                )
-                sys.exit(1)
-
-    def add_user_to_group(self, username, allocation):
-        r = self.session.get(f"{self.scim_url}/Groups/{allocation}")
-        if r.status_code == 200 and username not in [
-            x.get("value") for x in r.json().get("members", {})
-        ]:
-            payload = {
-                "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
-                "Operations": [
-                    {"op": "add", "value": {"members": [{"value": username}]}}
-                ],
-            }
-            r = self.session.patch(f"{self.scim_url}/Groups/{allocation}", json=payload)
-            if r.status_code in [200, 201]:
-                print(f"Added user {username} to allocation {allocation}.")
-            else:
-                logger.error(f"Error adding user {username}: {r.status_code}: {r.text}")
-                sys.exit(1)
+        print(f"Creating user {username}.")
+        payload = {
+            "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+            "userName": username,
+            "name": {
+                "givenName": first_name,
+                "familyName": last_name,
+            },
+            "emails": [
+                {
+                    "value": email,
+                    "type": "work",
+                    "primary": True,
+                }
+            ],
+        }
+        r = self.request("POST", "Users", json=payload)
+        if r.status_code != 201:
+            raise RuntimeError(
+                f"Error creating user {username}: {r.status_code}: {r.text}"
+            )
+        print(f"Created user {username}.")
+
+    def add_users_to_group(self, usernames, allocation):
+        """Adds the users who aren't members of the allocation with a single PATCH."""
+        r = self.request("GET", f"Groups/{allocation}")
+        if r.status_code != 200:
+            raise RuntimeError(
+                f"Error getting allocation {allocation}: {r.status_code}: {r.text}"
+            )
+
+        members = {x.get("value") for x in r.json().get("members", [])}
+        missing = [username for username in usernames if username not in members]
+        if not missing:
+            return
+
+        payload = {
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:PatchOp"],
+            "Operations": [
+                {
+                    "op": "add",
+                    "value": {"members": [{"value": username} for username in missing]},
+                }
+            ],
+        }
+        r = self.request("PATCH", f"Groups/{allocation}", json=payload)
+        if r.status_code not in [200, 201]:
+            raise RuntimeError(
+                f"Error adding users {', '.join(missing)} to allocation {allocation}: "
+                f"{r.status_code}: {r.text}"
+            )
+        print(f"Added users {', '.join(missing)} to allocation {allocation}.")
+
+
+def user_filter(usernames):
+    """
+    Returns a SCIM filter matching the users with any of the usernames. The
+    usernames are quoted as JSON strings (RFC 7644, section 3.4.2.2), so that
+    quotes and backslashes in them are escaped.
+    """
+    return " or ".join(f"userName eq {json.dumps(username)}" for username in usernames)
 
 
 def get_sanitized_name(name):
@@ -274,7 +399,26 @@ def get_sanitized_name(name):
     default="",
     help="User to impersonate for temporary authentication workaround.",
 )
-def main(csv_file, add_to_rhods_notebooks_namespace, auth_type, impersonate_user):
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=4,
+    help="Number of requests to ColdFront made in parallel. Defaults to 4.",
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    default=10,
+    help="Maximum number of requests to ColdFront per second. Defaults to 10.",
+)
+def main(
+    csv_file,
+    add_to_rhods_notebooks_namespace,
+    auth_type,
+    impersonate_user,
+    concurrency,
+    rate,
+):
     if auth_type == "workaround":
         if not impersonate_user:
             raise ValueError("Must provide --impersonate-user argument.")
@@ -286,30 +430,80 @@ def main(csv_file, add_to_rhods_notebooks_namespace, auth_type, impersonate_user
         "https://coldfront.mss.mghpcc.org/api/scim/v2",
         "https://keycloak.mss.mghpcc.org",
         auth_type,
+        concurrency=concurrency,
+        rate=rate,
     )
 
+    errors = []
+    users = {}
+    allocations = {}
     with open(csv_file, newline="") as csvfile:
         reader = csv.reader(csvfile, delimiter=",", quotechar="|")
-        for index, row in enumerate(reader):
-            logger.info(f"Processing: {row}.")
-
+        for index, row in enumerate(reader, start=1):
+            if len(row) < 4 or not row[0] or not row[3]:
+                errors.append(f"Row {index}: invalid row {row}")
+                continue
+            users.setdefault(row[0], row)
+            members = allocations.setdefault(row[3], [])
+            if row[0] not in members:
+                members.append(row[0])
+
+    logger.info(f"Processing {len(users)} users in {len(allocations)} allocations.")
+
+    try:
+        existing = client.find_existing_users(list(users))
+    except requests.RequestException as e:
+        sys.exit(f"Error looking up users: {e}")
+    for username in existing:
+        print(f"User {username} exists.")
+
+    def create_user(row):
+        try:
             client.create_user(
                 username=row[0], first_name=row[1], last_name=row[2], email=row[0]
             )
-            client.add_user_to_group(username=row[0], allocation=row[3])
-
-            if add_to_rhods_notebooks_namespace:
-                logger.info("Adding user to rhods notebooks.")
-                sanitized_name = get_sanitized_name(row[0])
-                os.system(
-                    f"oc -n rhods-notebooks create rolebinding {sanitized_name} --clusterrole=edit --user={row[0]} --as system:admin"
-                )
+        except (RuntimeError, requests.RequestException) as e:
+            errors.append(str(e))
+            return row[0]
+
+    def add_users_to_group(allocation, usernames):
+        try:
+            client.add_users_to_group(usernames, allocation)
+        except (RuntimeError, requests.RequestException) as e:
+            errors.append(str(e))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        failed = set(
+            executor.map(
+                create_user,
+                [row for username, row in users.items() if username not in existing],
+            )
+        )
+        list(
+            executor.map(
+                add_users_to_group,
+                allocations.keys(),
+                [
+                    [username for username in usernames if username not in failed]
+                    for usernames in allocations.values()
+                ],
+            )
+        )
 
-            # Rate-limiting
-            time.sleep(0.5)
+    if add_to_rhods_notebooks_namespace:
+        for username in users:
+            if username in failed:
+                continue
+            logger.info(f"Adding user {username} to rhods notebooks.")
+            sanitized_name = get_sanitized_name(username)
+            os.system(
+                f"oc -n rhods-notebooks create rolebinding {sanitized_name} --clusterrole=edit --user={username} --as system:admin"
+            )
 
-            if index % 50 == 49:
-                client.session = client.refresh_session()
+    if errors:
+        for error in errors:
+            logger.error(error)
+        sys.exit(f"{len(errors)} errors occurred, see above.")
 
 
 if __name__ == "__main__":